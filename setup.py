@@ -8,6 +8,7 @@ install_requires = [
     'setuptools',
     'zc.buildout',
     'six',
+    'futures; python_version < "3"',
 ]
 
 tests_require = [
@@ -84,6 +85,7 @@ setup(name='mr.developer',
       deactivate = mr.developer.commands:CmdDeactivate
       help = mr.developer.commands:CmdHelp
       info = mr.developer.commands:CmdInfo
+      invalidate = mr.developer.commands:CmdInvalidate
       list = mr.developer.commands:CmdList
       pony = mr.developer.commands:CmdPony
       purge = mr.developer.commands:CmdPurge
@@ -1,6 +1,5 @@
 from mr.developer import common
 import os
-import subprocess
 
 logger = common.logger
 
@@ -10,6 +9,9 @@ class BazaarError(common.WCError):
 
 
 class BazaarWorkingCopy(common.BaseWorkingCopy):
+    _fingerprint_files = (
+        '.bzr/checkout/dirstate', '.bzr/branch/last-revision',
+        '.bzr/branch/branch.conf')
 
     def __init__(self, source):
         super(BazaarWorkingCopy, self).__init__(source)
@@ -24,13 +26,10 @@ class BazaarWorkingCopy(common.BaseWorkingCopy):
                 (logger.info, 'Skipped branching existing package %r.' % name))
             return
         self.output((logger.info, 'Branched %r with bazaar.' % name))
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.bzr_executable, 'branch', '--quiet', url, path],
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(
+            [self.bzr_executable, 'branch', '--quiet', url, path], network=True,
+            target=path, env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             raise BazaarError(
                 'bzr branch for %r failed.\n%s' % (name, stderr))
         if kwargs.get('verbose', False):
@@ -41,13 +40,10 @@ class BazaarWorkingCopy(common.BaseWorkingCopy):
         path = self.source['path']
         url = self.source['url']
         self.output((logger.info, 'Updated %r with bazaar.' % name))
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.bzr_executable, 'pull', url], cwd=path,
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(
+            [self.bzr_executable, 'pull', url], cwd=path, network=True,
+            env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             raise BazaarError(
                 'bzr pull for %r failed.\n%s' % (name, stderr))
         if kwargs.get('verbose', False):
@@ -68,30 +64,32 @@ class BazaarWorkingCopy(common.BaseWorkingCopy):
                     'Source URL for existing package %r differs. '
                     'Expected %r.' % (name, self.source['url']))
         else:
+            self.work = 'checkout'
             return self.bzr_branch(**kwargs)
 
     def matches(self):
         name = self.source['name']
         path = self.source['path']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
+        returncode, stdout, stderr = common.runner.run(
             [self.bzr_executable, 'info'], cwd=path,
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+            env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             raise BazaarError(
                 'bzr info for %r failed.\n%s' % (name, stderr))
         return (self.source['url'] in stdout.split())
 
     def status(self, **kwargs):
         path = self.source['path']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.bzr_executable, 'status'], cwd=path,
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
+        env = common.environment(unset=['PYTHONPATH'])
+        args = [self.bzr_executable, 'status']
+        if not self.source.get('untracked', True):
+            args.append('--versioned')
+        if kwargs.get('verbose', False):
+            returncode, stdout, stderr = common.runner.run(args, cwd=path, env=env)
+        else:
+            # any output means there are changes
+            returncode, stdout, stderr = common.runner.run_until(
+                args, lambda line: True, cwd=path, env=env)
         status = stdout and 'dirty' or 'clean'
         if kwargs.get('verbose', False):
             return status, stdout
@@ -107,4 +105,5 @@ class BazaarWorkingCopy(common.BaseWorkingCopy):
         if self.status() != 'clean' and not kwargs.get('force', False):
             raise BazaarError(
                 "Can't update package %r because it's dirty." % name)
+        self.work = 'update'
         return self.bzr_pull(**kwargs)
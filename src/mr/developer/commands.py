@@ -1,5 +1,5 @@
 from __future__ import print_function
-from mr.developer.common import logger, memoize, WorkingCopies, yesno
+from mr.developer.common import get_workingcopies_class, logger, memoize, StatusCache, Timings, yesno
 import argparse
 import errno
 import os
@@ -44,8 +44,28 @@ class Command(object):
     def __init__(self, develop):
         self.develop = develop
 
-    def get_workingcopies(self, sources):
-        return WorkingCopies(sources, threads=self.develop.threads)
+    def get_workingcopies(self, sources, continue_on_error=False, progress=False):
+        return get_workingcopies_class(self.develop.engine)(
+            sources,
+            threads=self.develop.threads,
+            continue_on_error=continue_on_error,
+            host_threads=self.develop.host_threads,
+            timings=self.get_timings(),
+            progress=progress)
+
+    def get_timings(self):
+        config = self.develop.config
+        if not getattr(config, 'timings', False):
+            return None
+        return Timings(config.timings_path)
+
+    def get_status_cache(self, args=None):
+        config = self.develop.config
+        if not getattr(config, 'status_cache', False):
+            return None
+        if getattr(args, 'no_cache', False):
+            return None
+        return StatusCache(config.status_cache_path)
 
     @memoize
     def get_packages(self, args, auto_checkout=False,
@@ -164,6 +184,14 @@ class CmdCheckout(Command):
             "-v", "--verbose", dest="verbose",
             action="store_true", default=False,
             help="""Show output of VCS command.""")
+        self.parser.add_argument(
+            "--continue-on-error", dest="continue_on_error",
+            action="store_true", default=False,
+            help="""Process the remaining packages after a package failed instead of stopping at the first error.""")
+        self.parser.add_argument(
+            "--progress", dest="progress",
+            action="store_true", default=False,
+            help="""Show the number of queued, running, finished and failed packages and the progress of the running ones.""")
         self.parser.add_argument(
             "package-regexp", nargs="+",
             help="A regular expression to match package names.")
@@ -174,7 +202,10 @@ class CmdCheckout(Command):
         packages = self.get_packages(getattr(args, 'package-regexp'),
                                      auto_checkout=args.auto_checkout)
         try:
-            workingcopies = self.get_workingcopies(self.develop.sources)
+            workingcopies = self.get_workingcopies(
+                self.develop.sources,
+                continue_on_error=args.continue_on_error,
+                progress=args.progress)
             workingcopies.checkout(sorted(packages),
                                    verbose=args.verbose,
                                    submodules=self.develop.update_git_submodules,
@@ -396,6 +427,36 @@ class CmdInfo(Command):
                 print()
 
 
+class CmdInvalidate(Command):
+    def __init__(self, develop):
+        Command.__init__(self, develop)
+        description = "Removes packages from the status cache, so their status is determined again by the next 'status' or 'list -s' command."
+        self.parser = self.develop.parsers.add_parser(
+            "invalidate",
+            description=description)
+        self.develop.parsers._choices_actions.append(ChoicesPseudoAction(
+            "invalidate", help=description))
+        self.parser.add_argument(
+            "package-regexp", nargs="*",
+            help="A regular expression to match package names. If none is given, the whole cache is cleared.")
+        self.parser.set_defaults(func=self)
+
+    def __call__(self, args):
+        status_cache = StatusCache(self.develop.config.status_cache_path)
+        package_regexp = getattr(args, 'package-regexp')
+        if package_regexp:
+            packages = sorted(self.get_packages(package_regexp))
+        else:
+            packages = None
+        status_cache.invalidate(packages)
+        status_cache.save()
+        if packages is None:
+            logger.info("Cleared the status cache.")
+        else:
+            for name in packages:
+                logger.info("Invalidated cached status of '%s'." % name)
+
+
 class CmdList(Command):
     def __init__(self, develop):
         Command.__init__(self, develop)
@@ -434,6 +495,10 @@ class CmdList(Command):
                    '~' not in auto-checkout list, but checked out
                    '!' in auto-checkout list, but not checked out
                    'C' the repository URL doesn't match"""))
+        self.parser.add_argument(
+            "--no-cache", dest="no_cache",
+            action="store_true", default=False,
+            help="""Don't use the status cache, even if it's enabled.""")
         self.parser.add_argument("package-regexp", nargs="*",
                                  help="A regular expression to match package names.")
         self.parser.set_defaults(func=self)
@@ -445,13 +510,21 @@ class CmdList(Command):
                                      auto_checkout=args.auto_checkout,
                                      checked_out=args.checked_out,
                                      develop=args.develop)
-        workingcopies = self.get_workingcopies(sources)
+        if args.status:
+            workingcopies = self.get_workingcopies(sources)
+            status_cache = self.get_status_cache(args)
+            results = workingcopies.probe(
+                [x for x in packages if sources[x].exists()],
+                status=False, cache=status_cache)
+            if status_cache is not None:
+                status_cache.save()
         for name in sorted(packages):
             source = sources[name]
             info = []
             if args.status:
-                if source.exists():
-                    if not workingcopies.matches(source):
+                if name in results:
+                    matches = results[name][0]
+                    if not matches:
                         info.append("C")
                     else:
                         if name in auto_checkout:
@@ -691,6 +764,14 @@ class CmdStatus(Command):
             "-v", "--verbose", dest="verbose",
             action="store_true", default=False,
             help="""Show output of VCS command.""")
+        self.parser.add_argument(
+            "--no-cache", dest="no_cache",
+            action="store_true", default=False,
+            help="""Don't use the status cache, even if it's enabled.""")
+        self.parser.add_argument(
+            "--remote", dest="remote",
+            action="store_true", default=False,
+            help="""Ask the remote repositories for changes which weren't pushed yet, where that isn't known locally (mercurial). This needs network access.""")
         self.parser.add_argument(
             "package-regexp", nargs="*",
             help="A regular expression to match package names.")
@@ -706,26 +787,29 @@ class CmdStatus(Command):
                                      checked_out=args.checked_out,
                                      develop=args.develop)
         workingcopies = self.get_workingcopies(self.develop.sources)
+        status_cache = self.get_status_cache(args)
+        results = workingcopies.probe(
+            [x for x in packages if self.develop.sources[x].exists()],
+            verbose=args.verbose, cache=status_cache, remote=args.remote)
+        if status_cache is not None:
+            status_cache.save()
         paths = []
         for name in sorted(packages):
             source = self.develop.sources[name]
-            if not source.exists():
+            if name not in results:
                 if name in auto_checkout:
                     print("!     %s" % name)
                 continue
             paths.append(source['path'])
+            matches, status, output = results[name]
             info = []
-            if not workingcopies.matches(source):
+            if not matches:
                 info.append("C")
             else:
                 if name in auto_checkout:
                     info.append(" ")
                 else:
                     info.append("~")
-            if args.verbose:
-                status, output = workingcopies.status(source, verbose=True)
-            else:
-                status = workingcopies.status(source)
             if status == 'clean':
                 info.append(" ")
             elif status == 'ahead':
@@ -797,6 +881,14 @@ class CmdUpdate(Command):
             "-v", "--verbose", dest="verbose",
             action="store_true", default=False,
             help="""Show output of VCS command.""")
+        self.parser.add_argument(
+            "--continue-on-error", dest="continue_on_error",
+            action="store_true", default=False,
+            help="""Process the remaining packages after a package failed instead of stopping at the first error.""")
+        self.parser.add_argument(
+            "--progress", dest="progress",
+            action="store_true", default=False,
+            help="""Show the number of queued, running, finished and failed packages and the progress of the running ones.""")
         self.parser.add_argument(
             "package-regexp", nargs="*",
             help="A regular expression to match package names.")
@@ -807,7 +899,10 @@ class CmdUpdate(Command):
                                      auto_checkout=args.auto_checkout,
                                      checked_out=True,
                                      develop=args.develop)
-        workingcopies = self.get_workingcopies(self.develop.sources)
+        workingcopies = self.get_workingcopies(
+            self.develop.sources,
+            continue_on_error=args.continue_on_error,
+            progress=args.progress)
         force = args.force or self.develop.always_checkout
         workingcopies.update(sorted(packages),
                              force=force,
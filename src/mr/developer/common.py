@@ -1,16 +1,23 @@
+from concurrent import futures
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import pkg_resources
 import platform
-try:
-    import queue
-except ImportError:
-    import Queue as queue
 import re
-import subprocess
+import shutil
+import signal
 import six
+import subprocess
 import sys
 import threading
+import time
 if sys.version_info < (3, ):
     from ConfigParser import RawConfigParser
 else:
@@ -38,26 +45,61 @@ except NameError:
     raw_input = input
 
 
+class ToolCache(object):
+    """ A process wide, thread safe cache for things like executable lookups
+        and tool versions, which don't change during a run, but would
+        otherwise be determined again for each working copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._values = {}
+
+    def get(self, key, factory):
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = factory()
+            return self._values[key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+tool_cache = ToolCache()
+
+
 # shameless copy from
 # http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python
-def which(name_root, default=None):
+def _which(name_root, paths, pathext):
     def is_exe(fpath):
         return os.path.exists(fpath) and os.access(fpath, os.X_OK)
 
-    if platform.system() == 'Windows':
+    if pathext is not None:
         # http://www.voidspace.org.uk/python/articles/command_line.shtml#pathext
-        pathext = os.environ['PATHEXT']
         # example: ['.py', '.pyc', '.pyo', '.pyw', '.COM', '.EXE', '.BAT', '.CMD']
         names = [name_root + ext for ext in pathext.split(';')]
     else:
         names = [name_root]
 
     for name in names:
-        for path in os.environ["PATH"].split(os.pathsep):
+        for path in paths.split(os.pathsep):
             exe_file = os.path.join(path, name)
             if is_exe(exe_file):
                 return exe_file
 
+
+def which(name_root, default=None):
+    paths = os.environ["PATH"]
+    pathext = None
+    if platform.system() == 'Windows':
+        pathext = os.environ['PATHEXT']
+    exe_file = tool_cache.get(
+        ('which', name_root, paths, pathext),
+        functools.partial(_which, name_root, paths, pathext))
+    if exe_file is not None:
+        return exe_file
+
     if default is not None:
         return default
 
@@ -65,6 +107,50 @@ def which(name_root, default=None):
     sys.exit(1)
 
 
+_scp_like_url = re.compile(r'^(?:[^@/\\]+@)?(?P<host>[^:/\\]+):')
+
+
+def url_host(url):
+    """ Returns the lower cased host name of a repository URL, or ``None``
+        for local paths and ``file:`` URLs.
+
+        >>> url_host('https://User@Git.Example.com:8443/repo.git')
+        'git.example.com'
+        >>> url_host('git@github.com:fschulze/mr.developer.git')
+        'github.com'
+        >>> url_host('file:///tmp/repo') is None
+        True
+    """
+    if not url:
+        return None
+    if '://' not in url:
+        match = _scp_like_url.match(url)
+        # a single letter is a windows drive and not a host
+        if match is None or len(match.group('host')) < 2:
+            return None
+        return match.group('host').lower()
+    hostname = six.moves.urllib.parse.urlsplit(url).hostname
+    return hostname.lower() if hostname else None
+
+
+def parse_host_threads(value):
+    """ Parses whitespace separated ``host=threads`` pairs into a dictionary.
+
+        >>> sorted(parse_host_threads('git.example.com=2 GitHub.com=4').items())
+        [('git.example.com', 2), ('github.com', 4)]
+    """
+    host_threads = {}
+    for item in value.split():
+        host, sep, threads = item.partition('=')
+        if not sep or not host:
+            raise ValueError("Invalid host threads entry '%s'." % item)
+        threads = int(threads)
+        if threads < 1:
+            raise ValueError("Invalid host threads entry '%s'." % item)
+        host_threads[host.lower()] = threads
+    return host_threads
+
+
 def version_sorted(inp, *args, **kwargs):
     """
     Sorts components versions, it means that numeric parts of version
@@ -105,11 +191,584 @@ class WCError(Exception):
     """ A working copy error. """
 
 
+class CommandTimeoutError(WCError):
+    """ A VCS command didn't finish in time. """
+
+
+class Profiler(object):
+    """ Collects timing spans of the working copy actions and of the VCS
+        commands they run, once a ``path`` is set with ``enable``.
+
+        The spans are written by ``save`` as a Chrome trace if the path ends
+        with ``.json`` and as JSON lines otherwise.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    @property
+    def package(self):
+        """ The name of the package whose action runs in this thread. """
+        return getattr(self._local, 'package', None)
+
+    def enable(self, path):
+        with self._lock:
+            self.path = path
+            del self._spans[:]
+
+    def add(self, name, category, start, duration, package=None, **args):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._spans.append(dict(
+                name=name, category=category, start=start, duration=duration,
+                package=package, thread=threading.current_thread().ident,
+                args=args))
+
+    @contextlib.contextmanager
+    def action(self, wc, name):
+        """ Records a span for the action ``name`` of the working copy
+            ``wc``, the commands run meanwhile in this thread are attributed
+            to its package.
+        """
+        if not self.enabled:
+            yield
+            return
+        package = wc.source.get('name')
+        outer = self.package
+        self._local.package = package
+        start = time.time()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self._local.package = outer
+            self.add(name, 'action', start, time.time() - start,
+                     package=package, error=error)
+
+    def take(self):
+        """ Returns the spans recorded so far and forgets them. """
+        with self._lock:
+            spans = list(self._spans)
+            del self._spans[:]
+        return spans
+
+    def extend(self, spans):
+        """ Adds the ``spans`` returned by ``take`` in another process. """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._spans.extend(spans)
+
+    def save(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            spans = list(self._spans)
+        with open(self.path, 'w') as f:
+            if self.path.endswith('.json'):
+                pid = os.getpid()
+                events = []
+                for span in spans:
+                    args = dict(span['args'])
+                    if span['package'] is not None:
+                        args['package'] = span['package']
+                    events.append(dict(
+                        name=span['name'], cat=span['category'], ph='X',
+                        ts=int(span['start'] * 1000000),
+                        dur=int(span['duration'] * 1000000),
+                        pid=pid, tid=span['thread'], args=args))
+                json.dump(dict(traceEvents=events), f)
+            else:
+                for span in spans:
+                    f.write(json.dumps(span, sort_keys=True))
+                    f.write('\n')
+        logger.info("Wrote profile with %d spans to '%s'." % (len(spans), self.path))
+
+
+profiler = Profiler()
+
+
+class Popen(subprocess.Popen):
+    """ A ``subprocess.Popen`` which adds a span with the command, its exit
+        code and the size of its output to the ``profiler`` when the command
+        finished with ``communicate``, or when ``record`` is called.
+
+        If a ``timeout`` in seconds is given, the command is started in its
+        own process group, which is killed once the timeout is reached. The
+        ``wait`` for the command then raises a ``CommandTimeoutError``.
+    """
+
+    def __init__(self, args, *posargs, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if timeout is not None and os.name == 'posix':
+            if six.PY2:
+                kwargs['preexec_fn'] = os.setsid
+            else:
+                kwargs['start_new_session'] = True
+        self._command = args
+        self._package = profiler.package
+        self._started = time.time()
+        self._recorded = False
+        self._timeout = timeout
+        self._timer = None
+        self.timed_out = False
+        subprocess.Popen.__init__(self, args, *posargs, **kwargs)
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._kill)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _kill(self):
+        self.timed_out = True
+        try:
+            if os.name == 'posix':
+                os.killpg(self.pid, signal.SIGKILL)
+            else:
+                self.kill()
+        except OSError:
+            pass
+
+    def wait(self, *args, **kwargs):
+        returncode = subprocess.Popen.wait(self, *args, **kwargs)
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.timed_out:
+            raise CommandTimeoutError(
+                "Command '%s' timed out after %s seconds." % (
+                    command_line(self._command), self._timeout))
+        return returncode
+
+    def communicate(self, *args, **kwargs):
+        stdout, stderr = subprocess.Popen.communicate(self, *args, **kwargs)
+        if profiler.enabled:
+            self.record(output_size(stdout) + output_size(stderr))
+        return stdout, stderr
+
+    def record(self, size):
+        if self._recorded:
+            return
+        self._recorded = True
+        profiler.add(
+            'command', 'command', self._started, time.time() - self._started,
+            package=self._package, command=command_line(self._command),
+            returncode=self.returncode, output=size)
+
+
+def command_line(args):
+    if isinstance(args, six.string_types):
+        return args
+    return ' '.join(args)
+
+
+def environment(unset=(), **variables):
+    """ Returns a copy of ``os.environ`` without the variables listed in
+        ``unset`` and with the given ``variables`` set. The copy is made once
+        per run and shared, so it must not be modified.
+    """
+    unset = tuple(sorted(unset))
+    variables = tuple(sorted(variables.items()))
+
+    def factory():
+        env = dict(os.environ)
+        for name in unset:
+            env.pop(name, None)
+        env.update(variables)
+        return env
+
+    return tool_cache.get(('environment', unset, variables), factory)
+
+
+_transient_error = re.compile(
+    r'could not resolve|temporary failure in name resolution|'
+    r'connection (?:timed out|reset|refused|closed)|operation timed out|'
+    r'network is unreachable|remote end hung up unexpectedly|early eof|'
+    r'unexpected disconnect|ssl_read|gnutls_handshake|'
+    r'(?:error|status)\W*5\d\d\b', re.IGNORECASE)
+
+
+class CommandRunner(object):
+    """ Runs the commands of the VCS backends.
+
+        Commands which access the ``network`` are killed together with their
+        child processes after ``timeout`` seconds, if set. If they time out
+        or fail with what looks like a temporary network problem, they are
+        run again up to ``retries`` times, waiting ``backoff`` seconds before
+        the first retry and twice as long before each further one.
+    """
+
+    def __init__(self, timeout=None, retries=0, backoff=1.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def popen(self, args, network=False, **kwargs):
+        """ Starts the command ``args`` and returns the ``Popen`` instance. """
+        if network:
+            kwargs['timeout'] = self.timeout
+        return Popen(args, **kwargs)
+
+    def run(self, args, network=False, input=None, target=None, **kwargs):
+        """ Runs the command ``args`` to completion and returns a tuple of
+            its exit code, output and error output. See ``retry`` for the
+            ``target``.
+        """
+        kwargs.setdefault('stdout', subprocess.PIPE)
+        kwargs.setdefault('stderr', subprocess.PIPE)
+
+        def run():
+            cmd = self.popen(args, network=network, **kwargs)
+            stdout, stderr = cmd.communicate(input)
+            return cmd.returncode, stdout, stderr
+
+        return self.retry(run, network=network, target=target)
+
+    def run_until(self, args, stop, **kwargs):
+        """ Runs the command ``args`` like ``run``, but stops it as soon as
+            ``stop`` returns true for a line of its output, see
+            ``read_until``. The exit code is ``None`` in that case. Commands
+            stopped early aren't retried.
+        """
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+        stdout, stderr, returncode = read_until(self.popen(args, **kwargs), stop)
+        return returncode, stdout, stderr
+
+    def is_transient(self, stderr):
+        if isinstance(stderr, six.binary_type):
+            stderr = stderr.decode('utf8', 'replace')
+        return _transient_error.search(stderr or '') is not None
+
+    def retry(self, func, network=False, target=None):
+        """ Calls ``func``, which runs a command and returns a tuple starting
+            with its exit code and ending with its error output, and calls it
+            again as described above if the command accesses the ``network``.
+
+            If the command creates the directory ``target``, like a clone, a
+            partial one left behind by a killed or failed attempt is removed
+            before the next one and after a timeout, unless it existed before
+            the first attempt.
+        """
+        created = target is not None and not os.path.exists(target)
+        attempt = 0
+        while True:
+            try:
+                result = func()
+            except CommandTimeoutError:
+                if not network or attempt >= self.retries:
+                    # a killed command doesn't clean up after itself
+                    if created:
+                        self._remove_target(target)
+                    raise
+                reason = sys.exc_info()[1].args[0]
+            else:
+                if result[0] == 0 or not network or attempt >= self.retries:
+                    return result
+                if not self.is_transient(result[-1]):
+                    return result
+                reason = "Command failed with a network error."
+            if created:
+                self._remove_target(target)
+            delay = self.backoff * 2 ** attempt
+            attempt += 1
+            logger.warning("%s Retrying in %s seconds (%d/%d)." % (
+                reason, delay, attempt, self.retries))
+            time.sleep(delay)
+
+    def _remove_target(self, target):
+        if os.path.exists(target):
+            logger.debug("Removing the partial '%s'." % target)
+            shutil.rmtree(target, ignore_errors=True)
+
+
+runner = CommandRunner()
+
+
+def output_size(data):
+    """ Returns the size of the command output ``data`` in bytes. """
+    if not data:
+        return 0
+    if not isinstance(data, six.binary_type):
+        data = data.encode('utf8', 'replace')
+    return len(data)
+
+
+_progress_line = re.compile(r'^(?:remote: )?(?P<phase>[A-Za-z ]+):\s+(?P<percent>\d+)%')
+
+
+class OutputChannel(object):
+    """ Forwards the output of the VCS commands run for a working copy line
+        by line as it arrives, prefixed with the package name, if ``echo`` is
+        set. The last ``size`` lines are kept in ``lines`` for error reports.
+
+        If ``progress`` is set, the VCS is asked to report its progress.
+        Those lines only update ``status``, which is shown by ``Progress``.
+    """
+
+    def __init__(self, name, echo=False, size=0):
+        self.name = name
+        self.echo = echo
+        self.progress = False
+        self.status = None
+        self.lines = collections.deque(maxlen=size)
+
+    def write(self, data):
+        if six.PY3 and isinstance(data, six.binary_type):
+            data = data.decode('utf8', 'replace')
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            match = _progress_line.match(line)
+            if match is not None:
+                self.status = "%s %s%%" % (match.group('phase'), match.group('percent'))
+                continue
+            self.lines.append(line)
+            if self.echo:
+                with output_lock:
+                    print("%s: %s" % (self.name, line))
+                    sys.stdout.flush()
+
+
+def stream_process(cmd, channel, errors=50):
+    """ Writes the output of the running ``subprocess.Popen`` instance
+        ``cmd``, which has to be in text mode, to the ``channel`` as it
+        arrives and waits for the process to finish. Returns the last
+        ``errors`` lines of its error output.
+    """
+    error_lines = collections.deque(maxlen=errors)
+    sizes = []
+
+    def read_stderr():
+        size = 0
+        for line in iter(cmd.stderr.readline, ''):
+            size += output_size(line)
+            error_lines.append(line)
+            channel.write(line)
+        sizes.append(size)
+
+    thread = threading.Thread(target=read_stderr)
+    thread.daemon = True
+    thread.start()
+    size = 0
+    for line in iter(cmd.stdout.readline, ''):
+        size += output_size(line)
+        channel.write(line)
+    thread.join()
+    cmd.wait()
+    if isinstance(cmd, Popen) and profiler.enabled:
+        cmd.record(size + sum(sizes))
+    return ''.join(error_lines)
+
+
+def read_until(cmd, stop):
+    """ Reads the output of the running ``subprocess.Popen`` instance
+        ``cmd`` line by line until ``stop`` returns true for a line and
+        terminates the command at that point. Returns the output read so
+        far, the error output and the exit code, which is ``None`` if the
+        command was terminated.
+    """
+    # an empty string or bytes, depending on the mode of the pipe
+    empty = cmd.stdout.read(0)
+    errors = []
+    thread = threading.Thread(target=lambda: errors.append(cmd.stderr.read()))
+    thread.daemon = True
+    thread.start()
+    lines = []
+    stopped = False
+    try:
+        for line in iter(cmd.stdout.readline, empty):
+            lines.append(line)
+            if stop(line):
+                stopped = True
+                try:
+                    cmd.terminate()
+                except OSError:
+                    pass
+                break
+    finally:
+        cmd.stdout.close()
+        thread.join()
+        cmd.wait()
+    stdout = empty.join(lines)
+    stderr = errors[0] if errors else empty
+    if isinstance(cmd, Popen) and profiler.enabled:
+        cmd.record(output_size(stdout) + output_size(stderr))
+    return stdout, stderr, None if stopped else cmd.returncode
+
+
+class Progress(object):
+    """ Shows how many of the jobs run by ``WorkingCopies.process`` are
+        queued, running, done and failed, together with the running packages,
+        how long they are running and the progress reported by their VCS.
+
+        On a terminal a status line is redrawn every ``interval`` seconds,
+        otherwise the same information is logged every ``log_interval``
+        seconds.
+    """
+    interval = 0.2
+    log_interval = 10
+
+    def __init__(self, stream=None):
+        if stream is None:
+            stream = sys.stderr
+        self.stream = stream
+        isatty = getattr(stream, 'isatty', None)
+        self.tty = bool(isatty is not None and isatty())
+        self.queued = 0
+        self.done = 0
+        self.failed = 0
+        self.running = {}
+        self.started = time.time()
+        self._shown = False
+        self._logged = self.started
+
+    def queue(self):
+        self.queued += 1
+
+    def start(self, wc):
+        self.queued -= 1
+        self.running[wc.source['name']] = (time.time(), wc.stream)
+
+    def finish(self, wc, success):
+        self.running.pop(wc.source['name'], None)
+        if success:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    def summary(self):
+        return "%d done, %d failed, %d running, %d queued" % (
+            self.done, self.failed, len(self.running), self.queued)
+
+    def packages(self):
+        """ Returns descriptions of the running packages, the longest
+            running first.
+        """
+        now = time.time()
+        result = []
+        for name, (start, stream) in sorted(
+                self.running.items(), key=lambda item: item[1][0]):
+            info = "%s %ds" % (name, now - start)
+            status = getattr(stream, 'status', None)
+            if status:
+                info = "%s (%s)" % (info, status)
+            result.append(info)
+        return result
+
+    def _width(self):
+        get_terminal_size = getattr(shutil, 'get_terminal_size', None)
+        if get_terminal_size is None:
+            return int(os.environ.get('COLUMNS', 80))
+        return get_terminal_size().columns
+
+    def show(self):
+        with output_lock:
+            if self.tty:
+                line = "%s: %s" % (self.summary(), ", ".join(self.packages()))
+                self.stream.write("\r\x1b[K" + line[:self._width() - 1])
+                self.stream.flush()
+                self._shown = True
+            elif time.time() - self._logged >= self.log_interval:
+                self._logged = time.time()
+                logger.info("Progress: %s." % self.summary())
+                for info in self.packages():
+                    logger.info("    %s" % info)
+
+    def clear(self):
+        """ Removes the status line, so other output can be written. """
+        with output_lock:
+            if self._shown:
+                self.stream.write("\r\x1b[K")
+                self.stream.flush()
+                self._shown = False
+
+    def close(self):
+        self.clear()
+        logger.info("Processed %d packages in %ds, %d failed." % (
+            self.done + self.failed, time.time() - self.started, self.failed))
+
+
+def show_progress(progress, stopped):
+    """ Shows ``progress`` every ``interval`` until ``stopped`` is set. """
+    while not stopped.wait(progress.interval):
+        progress.show()
+
+
 class BaseWorkingCopy(object):
+    # paths relative to the checkout which change whenever the status of
+    # the working copy may change, see ``fingerprint``
+    _fingerprint_files = ()
+    # the number of output lines kept for error reports
+    _output_lines = 20
+
     def __init__(self, source):
         self._output = []
         self.output = self._output.append
         self.source = source
+        self.stream = OutputChannel(source.get('name'), size=self._output_lines)
+        # the work done by the last action, 'checkout' for a new checkout
+        # and 'update' for an update, ``None`` if it skipped the package
+        self.work = None
+
+    def fingerprint(self):
+        """ Returns a string built from the modification times and sizes of
+            the VCS metadata files listed in ``_fingerprint_files`` and the
+            newest modification time of the top level entries of the working
+            copy, or ``None`` if none of the metadata files exist. This is
+            used to cache the status of unchanged working copies between
+            runs. Modifications of tracked files in subdirectories aren't
+            noticed if they don't touch the metadata.
+        """
+        path = self.source['path']
+        parts = []
+        found = False
+        for name in ('',) + tuple(self._fingerprint_files):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                parts.append('%s:-' % name)
+                continue
+            if name:
+                found = True
+            parts.append('%s:%r:%d' % (name, st.st_mtime, st.st_size))
+        if not found:
+            return None
+        parts.append('worktree:%r:%d' % self._worktree_mtime())
+        return ' '.join(parts)
+
+    def _worktree_mtime(self):
+        """ Returns the newest modification time and the number of the top
+            level entries of the working copy besides the VCS metadata.
+        """
+        path = self.source['path']
+        metadata = set(x.split('/')[0] for x in self._fingerprint_files)
+        newest = 0
+        count = 0
+        for name in os.listdir(path):
+            if name in metadata:
+                continue
+            try:
+                st = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue
+            newest = max(newest, st.st_mtime)
+            count += 1
+        return newest, count
+
+    @classmethod
+    def prefetch(klass, wcs, status=True):
+        """ Called by ``WorkingCopies.probe`` with all working copies of
+            this class which are about to be probed. Subclasses can cache
+            the results of batched VCS commands here.
+        """
 
     def should_update(self, **kwargs):
         offline = kwargs.get('offline', False)
@@ -158,45 +817,66 @@ def yesno(question, default=True, all=True):
 main_lock = input_lock = output_lock = threading.RLock()
 
 
-def worker(working_copies, the_queue):
-    while True:
-        if working_copies.errors:
-            return
-        try:
-            wc, action, kwargs = the_queue.get_nowait()
-        except queue.Empty:
-            return
-        try:
-            output = action(**kwargs)
-        except WCError:
-            output_lock.acquire()
-            for lvl, msg in wc._output:
-                lvl(msg)
-            for line in sys.exc_info()[1].args[0].split('\n'):
+def run_action(wc, action, kwargs):
+    """ Runs ``action`` with ``kwargs`` and returns a tuple of a success flag
+        and the output of the action or the error which occurred.
+    """
+    stream = getattr(wc, 'stream', None)
+    if stream is not None:
+        stream.echo = kwargs.get('verbose', False)
+        stream.progress = kwargs.get('progress', False)
+        stream.status = None
+    try:
+        if wc is None:
+            return True, action(**kwargs)
+        wc.work = None
+        with profiler.action(wc, action.__name__):
+            return True, action(**kwargs)
+    except (WCError, SystemExit):
+        return False, sys.exc_info()[1]
+
+
+def report_action(wc, kwargs, success, result):
+    """ Prints the log messages collected in ``wc._output`` and the outcome
+        of an action returned by ``run_action``.
+    """
+    with output_lock:
+        # See GitHub issue # 210
+        # wc._output is a list containing n-length tuples which are messages from the thread.
+        # each tuple (item) first position is a logger function
+        # the rest of the tuple is the message.
+
+        # In cases where the message tuple has more than 2 elements in it
+        #  (logger, message, message, ... )
+        # then all messages are joined.
+        for item in wc._output:
+            lvl = item[0]
+            msg = ','.join(item[1:])
+            lvl(msg)
+        del wc._output[:]
+
+        if not success:
+            errors = []
+            if isinstance(result, WCError):
+                errors = result.args[0].split('\n')
+            stream = getattr(wc, 'stream', None)
+            if stream is not None and not stream.echo:
+                # the error output is usually part of the error already
+                known = set(x.strip() for x in errors)
+                lines = [x for x in stream.lines if x.strip() not in known]
+                if lines:
+                    logger.info("Last output of '%s':" % stream.name)
+                    for line in lines:
+                        logger.info("    %s" % line)
+            for line in errors:
                 logger.error(line)
-            working_copies.errors = True
-            output_lock.release()
-        else:
-            output_lock.acquire()
-
-            # See GitHub issue # 210
-            # wc._output is a list containing n-length tuples which are messages from the thread.
-            # each tuple (item) first position is a logger function
-            # the rest of the tuple is the message.
-
-            # In cases where the message tuple has more than 2 elements in it
-            #  (logger, message, message, ... )
-            # then all messages are joined.
-            for item in wc._output:
-                lvl = item[0]
-                msg = ','.join(item[1:])
-                lvl(msg)
+            return
 
-            if kwargs.get('verbose', False) and output is not None and output.strip():
-                if six.PY3 and isinstance(output, six.binary_type):
-                    output = output.decode('utf8')
-                print(output)
-            output_lock.release()
+        output = result
+        if kwargs.get('verbose', False) and output is not None and output.strip():
+            if six.PY3 and isinstance(output, six.binary_type):
+                output = output.decode('utf8')
+            print(output)
 
 
 _workingcopytypes = None
@@ -244,44 +924,288 @@ def get_commands():
     return commands.values()
 
 
+def get_workingcopies_class(engine='threads'):
+    """ Returns the ``WorkingCopies`` class of the ``engine``, which is
+        either ``threads`` or ``processes``.
+    """
+    if engine == 'threads':
+        return WorkingCopies
+    if engine == 'processes':
+        return ProcessWorkingCopies
+    raise ValueError("Unknown engine '%s'." % engine)
+
+
 class WorkingCopies(object):
-    def __init__(self, sources, threads=5):
+    def __init__(self, sources, threads=5, continue_on_error=False, host_threads=None, timings=None, progress=False):
         self.sources = sources
         self.threads = threads
+        self.host_threads = host_threads or {}
+        self.timings = timings
+        self.progress = progress
+        self.continue_on_error = continue_on_error
         self.errors = False
         self.workingcopytypes = get_workingcopytypes()
+        # the pool running the jobs of ``process``, shared with status checks
+        self._executor = None
+
+    def _handle_result(self, wc, kwargs, success, result):
+        report_action(wc, kwargs, success, result)
+        if not success:
+            self.errors = True
+
+    def _run_job(self, wc, action, kwargs):
+        start = time.time()
+        success, result = run_action(wc, action, kwargs)
+        if success:
+            self._record_work(wc, start)
+        return success, result
+
+    def _record_work(self, wc, start):
+        """ Records the time since ``start`` in ``timings`` under the work
+            done by the last action of ``wc``. Skipped packages aren't
+            recorded, and the updates done by ``checkout`` are recorded as
+            updates.
+        """
+        if self.timings is not None and wc.work is not None:
+            self.timings.set(wc.work, wc.source['name'], time.time() - start)
+
+    def _job_priority(self, job):
+        """ Returns the sort key of a job, new packages and the ones with the
+            longest duration in previous runs come first.
+        """
+        wc, action, kwargs = job
+        if self.timings is None:
+            return (0, 0)
+        return self._expected_priority(action.__name__, wc.source['name'])
+
+    def _expected_priority(self, action, name):
+        duration = self.timings.get(action, name)
+        if duration is None:
+            return (0, 0)
+        return (1, -duration)
+
+    def _slowest_first(self, packages, action):
+        """ Returns the ``packages`` ordered like ``_job_priority`` would. """
+        packages = list(packages)
+        if self.timings is None:
+            return packages
+        return sorted(
+            packages, key=functools.partial(self._expected_priority, action))
+
+    def process(self, jobs):
+        """ Runs the ``(wc, action, kwargs)`` tuples from the ``jobs``
+            iterable on a pool of ``threads`` workers.
+
+            Jobs are scheduled while the iterable is consumed, so work starts
+            while the remaining jobs are still being determined, and results
+            are reported as soon as they are available. On the first error
+            no further jobs are started, unless ``continue_on_error`` is set.
+
+            Of the jobs waiting for a free worker, the ones which took the
+            longest in previous runs according to ``timings`` are started
+            first. Jobs for a host listed in ``host_threads`` are held back
+            while that many jobs for the same host are running, jobs for
+            other hosts are started in the meantime.
+
+            With ``progress`` set the state of the jobs is shown by
+            ``Progress`` while they run.
+        """
+        progress = Progress() if self.progress else None
+        self._process_jobs(jobs, progress)
+        if progress is not None:
+            progress.close()
+
+        if self.timings is not None:
+            self.timings.save()
+        if self.errors:
+            logger.error("There have been errors, see messages above.")
+            sys.exit(1)
 
-    def process(self, the_queue):
+    def _process_jobs(self, jobs, progress):
         if self.threads < 2:
-            worker(self, the_queue)
+            for wc, action, kwargs in jobs:
+                if progress is not None:
+                    progress.queue()
+                    progress.start(wc)
+                    progress.show()
+                    # the job runs in this thread, so another one redraws
+                    # the progress while it runs
+                    stopped = threading.Event()
+                    ticker = threading.Thread(
+                        target=show_progress, args=(progress, stopped))
+                    ticker.daemon = True
+                    ticker.start()
+                try:
+                    success, result = self._run_job(wc, action, kwargs)
+                finally:
+                    if progress is not None:
+                        stopped.set()
+                        ticker.join()
+                if progress is not None:
+                    progress.finish(wc, success)
+                    progress.clear()
+                self._handle_result(wc, kwargs, success, result)
+                if self.errors and not self.continue_on_error:
+                    break
         else:
-            if sys.version_info < (2, 6):
-                # work around a race condition in subprocess
-                _old_subprocess_cleanup = subprocess._cleanup
-
-                def _cleanup():
-                    pass
-
-                subprocess._cleanup = _cleanup
+            executor = self._executor = futures.ThreadPoolExecutor(max_workers=self.threads)
+            condition = threading.Condition(threading.RLock())
+            waiting = []
+            finished = []
+            running = {}
+            state = dict(active=0, stopped=False, count=0)
+
+            def start_waiting():
+                while waiting and state['active'] < self.threads and not state['stopped']:
+                    for index, (priority, count, job, host) in enumerate(waiting):
+                        limit = self.host_threads.get(host)
+                        if limit is None or running.get(host, 0) < limit:
+                            break
+                    else:
+                        return
+                    del waiting[index]
+                    running[host] = running.get(host, 0) + 1
+                    state['active'] += 1
+                    if progress is not None:
+                        progress.start(job[0])
+                    future = executor.submit(self._run_job, *job)
+                    future.add_done_callback(functools.partial(done, job, host))
+
+            def done(job, host, future):
+                with condition:
+                    running[host] -= 1
+                    state['active'] -= 1
+                    finished.append((job, future))
+                    failed = future.exception() is not None or not future.result()[0]
+                    if progress is not None:
+                        progress.finish(job[0], not failed)
+                    if failed and not self.continue_on_error:
+                        state['stopped'] = True
+                        if progress is not None:
+                            progress.queued -= len(waiting)
+                        del waiting[:]
+                    start_waiting()
+                    condition.notify_all()
+
+            def report():
+                with condition:
+                    results = finished[:]
+                    del finished[:]
+                    if progress is not None and results:
+                        progress.clear()
+                for (wc, action, kwargs), future in results:
+                    success, result = future.result()
+                    self._handle_result(wc, kwargs, success, result)
 
-            threads = []
+            try:
+                for job in jobs:
+                    report()
+                    with condition:
+                        if state['stopped'] or (self.errors and not self.continue_on_error):
+                            break
+                        state['count'] += 1
+                        if progress is not None:
+                            progress.queue()
+                        bisect.insort(waiting, (
+                            self._job_priority(job), state['count'], job,
+                            url_host(job[0].source.get('url'))))
+                        start_waiting()
+                while True:
+                    report()
+                    with condition:
+                        if not finished and not state['active']:
+                            break
+                        if progress is not None:
+                            progress.show()
+                            if not finished:
+                                condition.wait(progress.interval)
+                        elif not finished:
+                            condition.wait()
+            finally:
+                with condition:
+                    state['stopped'] = True
+                    del waiting[:]
+                self._executor = None
+                executor.shutdown(wait=True)
+
+    def _map_unordered(self, func, items):
+        """ Calls ``func`` for each of the ``items`` on a pool of ``threads``
+            workers and yields ``(item, success, result)`` tuples in the
+            order the calls complete.
+
+            While ``process`` runs jobs, its pool is used, so the status
+            checks and the jobs together stay within ``threads``.
+        """
+        items = list(items)
+        if self.threads < 2 or len(items) < 2:
+            for item in items:
+                success, result = run_action(None, functools.partial(func, item), {})
+                yield item, success, result
+            return
+        executor = self._executor
+        if executor is None:
+            executor = futures.ThreadPoolExecutor(
+                max_workers=min(self.threads, len(items)))
+        try:
+            pending = dict(
+                (executor.submit(run_action, None, functools.partial(func, item), {}), item)
+                for item in items)
+            for future in futures.as_completed(pending):
+                success, result = future.result()
+                yield pending[future], success, result
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=True)
+
+    def _confirm_dirty_update(self, name):
+        with input_lock:
+            print_stderr("The package '%s' is dirty." % name)
+            return yesno("Do you want to update it anyway?", default=False, all=True)
+
+    def _candidate_status(self, candidate):
+        wc = candidate[1]
+        with profiler.action(wc, 'status'):
+            return wc.status()
+
+    def _clean_or_confirmed(self, candidates, kwargs):
+        """ Checks the status of the ``(name, wc, kw)`` ``candidates`` in
+            parallel and yields the clean ones as soon as they are known.
+
+            The dirty ones are held back until all checks are done and then
+            only yielded if the user confirms the update, or if it's forced.
+        """
+        dirty = []
+        checks = self._map_unordered(self._candidate_status, candidates)
+        for candidate, success, result in checks:
+            if not success:
+                self._handle_result(candidate[1], candidate[2], False, result)
+            elif result == 'clean':
+                yield candidate
+            else:
+                dirty.append(candidate)
+        for name, wc, kw in sorted(dirty, key=lambda candidate: candidate[0]):
+            if not kwargs.get('force', False):
+                answer = self._confirm_dirty_update(name)
+                if not answer:
+                    logger.info("Skipped update of '%s'." % name)
+                    continue
+                if answer == 'all':
+                    kwargs['force'] = True
+            kw['force'] = True
+            yield name, wc, kw
 
-            for i in range(self.threads):
-                thread = threading.Thread(target=worker, args=(self, the_queue))
-                thread.start()
-                threads.append(thread)
-            for thread in threads:
-                thread.join()
-            if sys.version_info < (2, 6):
-                subprocess._cleanup = _old_subprocess_cleanup
-                subprocess._cleanup()
+    def _submodule_jobs(self, packages):
+        """ Returns how many submodules a package may update at once.
 
-        if self.errors:
-            logger.error("There have been errors, see messages above.")
-            sys.exit(1)
+            Only a single package gets the ``threads``, with several ones
+            they already run in parallel and parallel submodule updates would
+            multiply the number of git processes, ignoring ``host_threads``.
+        """
+        if len(packages) == 1:
+            return max(self.threads, 1)
+        return 1
 
     def checkout(self, packages, **kwargs):
-        the_queue = queue.Queue()
         if 'update' in kwargs:
             if isinstance(kwargs['update'], bool):
                 pass
@@ -295,12 +1219,18 @@ class WorkingCopies(object):
                 logger.error("Unknown value '%s' for always-checkout option." % kwargs['update'])
                 sys.exit(1)
         kwargs.setdefault('submodules', 'always')
+        kwargs.setdefault('jobs', self._submodule_jobs(packages))
+        kwargs.setdefault('progress', bool(self.progress))
         if kwargs['submodules'] in ['always', 'never', 'checkout']:
             pass
         else:
             logger.error("Unknown value '%s' for update-git-submodules option." % kwargs['submodules'])
             sys.exit(1)
-        for name in packages:
+        self.process(self._checkout_jobs(packages, kwargs))
+
+    def _checkout_jobs(self, packages, kwargs):
+        candidates = []
+        for name in self._slowest_first(packages, 'checkout'):
             kw = kwargs.copy()
             if name not in self.sources:
                 logger.error("Checkout failed. No source defined for '%s'." % name)
@@ -317,19 +1247,14 @@ class WorkingCopies(object):
             elif os.path.islink(source['path']):
                 logger.info("Skipped update of linked '%s'." % name)
                 continue
-            elif update and wc.status() != 'clean' and not kw.get('force', False):
-                print_stderr("The package '%s' is dirty." % name)
-                answer = yesno("Do you want to update it anyway?", default=False, all=True)
-                if answer:
-                    kw['force'] = True
-                    if answer == 'all':
-                        kwargs['force'] = True
-                else:
-                    logger.info("Skipped update of '%s'." % name)
-                    continue
+            elif update and not kw.get('force', False):
+                candidates.append((name, wc, kw))
+                continue
+            logger.info("Queued '%s' for checkout.", name)
+            yield wc, wc.checkout, kw
+        for name, wc, kw in self._clean_or_confirmed(candidates, kwargs):
             logger.info("Queued '%s' for checkout.", name)
-            the_queue.put_nowait((wc, wc.checkout, kw))
-        self.process(the_queue)
+            yield wc, wc.checkout, kw
 
     def matches(self, source):
         name = source['name']
@@ -343,7 +1268,8 @@ class WorkingCopies(object):
             if wc is None:
                 logger.error("Unknown repository type '%s'." % kind)
                 sys.exit(1)
-            return wc.matches()
+            with profiler.action(wc, 'matches'):
+                return wc.matches()
         except WCError:
             for line in sys.exc_info()[1].args[0].split('\n'):
                 logger.error(line)
@@ -361,15 +1287,110 @@ class WorkingCopies(object):
             if wc is None:
                 logger.error("Unknown repository type '%s'." % kind)
                 sys.exit(1)
-            return wc.status(**kwargs)
+            with profiler.action(wc, 'status'):
+                return wc.status(**kwargs)
         except WCError:
             for line in sys.exc_info()[1].args[0].split('\n'):
                 logger.error(line)
             sys.exit(1)
 
-    def update(self, packages, **kwargs):
-        the_queue = queue.Queue()
+    def _probe(self, wc, status=True, verbose=False, remote=False):
+        with profiler.action(wc, 'matches'):
+            matches = wc.matches()
+        if not status:
+            return matches, None, None
+        kwargs = dict(remote=True) if remote else {}
+        with profiler.action(wc, 'status'):
+            if verbose:
+                status, output = wc.status(verbose=True, **kwargs)
+            else:
+                status, output = wc.status(**kwargs), None
+        return matches, status, output
+
+    def probe(self, packages, status=True, verbose=False, cache=None, remote=False):
+        """Returns a dictionary mapping each of the given package names to a
+        tuple of ``(matches, status, output)``.
+
+        The working copies are probed in parallel using the configured number
+        of threads, as each probe spawns one or more VCS processes. The
+        ``status`` and ``output`` are ``None`` if ``status`` is false, the
+        ``output`` is only set in ``verbose`` mode.
+
+        If a ``StatusCache`` is passed in, working copies with an unchanged
+        fingerprint are answered from it and the cache is updated with the
+        new results. Verbose probes always run the VCS commands.
+
+        With ``remote`` the status of VCS which need the network to find
+        out whether there are changes which weren't pushed is checked
+        against the remote repository. These probes don't use the cache
+        either.
+
+        Working copy classes with a ``prefetch`` class method get all their
+        working copies passed to it first, so they can gather the
+        information with fewer VCS processes.
+        """
+        jobs = []
+        cached = {}
+        fingerprints = {}
         for name in packages:
+            if name not in self.sources:
+                logger.error("Status failed. No source defined for '%s'." % name)
+                sys.exit(1)
+            source = self.sources[name]
+            kind = source['kind']
+            wc = self.workingcopytypes.get(kind)(source)
+            if wc is None:
+                logger.error("Unknown repository type '%s'." % kind)
+                sys.exit(1)
+            if cache is not None and not verbose and not remote:
+                fingerprint = getattr(wc, 'fingerprint', lambda: None)()
+                if fingerprint is not None:
+                    fingerprints[name] = fingerprint
+                    entry = cache.get(source, fingerprint)
+                    if entry is not None and (entry[1] is not None or not status):
+                        cached[name] = (entry[0], entry[1] if status else None, None)
+                        continue
+            jobs.append(wc)
+        by_class = {}
+        for wc in jobs:
+            by_class.setdefault(type(wc), []).append(wc)
+        for wc_class, wcs in by_class.items():
+            prefetch = getattr(wc_class, 'prefetch', None)
+            if prefetch is not None and len(wcs) > 1:
+                prefetch(wcs, status=status)
+        results = {}
+        probe = functools.partial(
+            self._probe, status=status, verbose=verbose, remote=remote)
+        for wc, success, result in self._map_unordered(probe, jobs):
+            results[wc.source['name']] = success, result
+        failed = False
+        for name in sorted(results):
+            success, result = results[name]
+            if success:
+                continue
+            if isinstance(result, SystemExit):
+                raise result
+            for line in result.args[0].split('\n'):
+                logger.error(line)
+            failed = True
+        if failed:
+            sys.exit(1)
+        results = dict((name, result) for name, (success, result) in results.items())
+        for name in fingerprints:
+            if name in results:
+                matches, status, output = results[name]
+                cache.set(self.sources[name], fingerprints[name], matches, status)
+        results.update(cached)
+        return results
+
+    def update(self, packages, **kwargs):
+        kwargs.setdefault('jobs', self._submodule_jobs(packages))
+        kwargs.setdefault('progress', bool(self.progress))
+        self.process(self._update_jobs(packages, kwargs))
+
+    def _update_jobs(self, packages, kwargs):
+        candidates = []
+        for name in self._slowest_first(packages, 'update'):
             kw = kwargs.copy()
             if name not in self.sources:
                 continue
@@ -379,19 +1400,94 @@ class WorkingCopies(object):
             if wc is None:
                 logger.error("Unknown repository type '%s'." % kind)
                 sys.exit(1)
-            if wc.status() != 'clean' and not kw.get('force', False):
-                print_stderr("The package '%s' is dirty." % name)
-                answer = yesno("Do you want to update it anyway?", default=False, all=True)
-                if answer:
-                    kw['force'] = True
-                    if answer == 'all':
-                        kwargs['force'] = True
-                else:
-                    logger.info("Skipped update of '%s'." % name)
-                    continue
+            if not kw.get('force', False):
+                candidates.append((name, wc, kw))
+                continue
+            logger.info("Queued '%s' for update.", name)
+            yield wc, wc.update, kw
+        for name, wc, kw in self._clean_or_confirmed(candidates, kwargs):
             logger.info("Queued '%s' for update.", name)
-            the_queue.put_nowait((wc, wc.update, kw))
-        self.process(the_queue)
+            yield wc, wc.update, kw
+
+
+def _process_settings():
+    """ Returns the settings of ``runner`` and ``profiler`` which have to be
+        applied in the worker processes of ``ProcessWorkingCopies``.
+    """
+    return dict(
+        timeout=runner.timeout, retries=runner.retries,
+        backoff=runner.backoff, profile=profiler.path)
+
+
+def _run_in_process(wc_class, source, action, kwargs, settings):
+    """ Runs the ``action`` of a new working copy of ``wc_class`` for the
+        ``source`` in a worker process of ``ProcessWorkingCopies``, with the
+        ``settings`` from ``_process_settings``. Returns the result of
+        ``run_action``, the collected log messages with the names of the
+        logger methods, the last lines of output, the work done by the action
+        and the profiler spans.
+    """
+    runner.timeout = settings['timeout']
+    runner.retries = settings['retries']
+    runner.backoff = settings['backoff']
+    # the spans are sent back, the worker never saves them
+    profiler.enable(settings['profile'])
+    wc = wc_class(source)
+    try:
+        success, result = run_action(wc, getattr(wc, action), kwargs)
+    except EOFError:
+        # the input of the worker is closed, so prompts fail
+        success, result = False, WCError(
+            "Can't ask for credentials or other input for '%s' with the "
+            "processes engine." % source['name'])
+    output = [(item[0].__name__,) + tuple(item[1:]) for item in wc._output]
+    return success, result, output, list(wc.stream.lines), wc.work, profiler.take()
+
+
+class ProcessWorkingCopies(WorkingCopies):
+    """ ``WorkingCopies`` running the checkouts and updates in a pool of
+        ``threads`` worker processes, so the Python code of the working
+        copies doesn't compete for the interpreter lock. The working copy
+        class and source of each job are sent to the worker together with
+        the settings of ``runner`` and ``profiler``, and the result, log
+        messages, errors and profiler spans are sent back. Status checks
+        still run in threads.
+
+        The workers can't ask questions, like for server certificates.
+    """
+
+    def _pool_kwargs(self):
+        if sys.version_info < (3, 7):
+            return {}
+        # forking a process with running threads isn't safe
+        return dict(mp_context=multiprocessing.get_context('spawn'))
+
+    def _process_jobs(self, jobs, progress):
+        self._pool = futures.ProcessPoolExecutor(
+            max_workers=max(self.threads, 1), **self._pool_kwargs())
+        try:
+            # start the workers before any threads are started
+            self._pool.submit(int).result()
+            super(ProcessWorkingCopies, self)._process_jobs(jobs, progress)
+        finally:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _run_job(self, wc, action, kwargs):
+        start = time.time()
+        # the worker can't report progress to this process
+        kwargs = dict(kwargs, progress=False)
+        future = self._pool.submit(
+            _run_in_process, type(wc), wc.source, action.__name__, kwargs,
+            _process_settings())
+        success, result, output, lines, wc.work, spans = future.result()
+        profiler.extend(spans)
+        for item in output:
+            wc.output((getattr(logger, item[0]),) + tuple(item[1:]))
+        wc.stream.lines.extend(lines)
+        if success:
+            self._record_work(wc, start)
+        return success, result
 
 
 def parse_buildout_args(args):
@@ -541,6 +1637,132 @@ class LegacyRewrite(Rewrite):
         Rewrite.__init__(self, "url ~ ^%s\n%s" % (prefix, substitution))
 
 
+def source_digest(source):
+    """ Returns a digest of the options of ``source`` except its name and
+        path, which changes whenever one of them is changed.
+
+        >>> digest = source_digest(dict(name='foo', kind='git', url='foo'))
+        >>> digest == source_digest(dict(name='bar', path='bar', kind='git', url='foo'))
+        True
+        >>> digest == source_digest(dict(name='foo', kind='git', url='foo', rev='1.0'))
+        False
+    """
+    options = dict(
+        (key, value) for key, value in source.items()
+        if key not in ('name', 'path'))
+    data = json.dumps(options, sort_keys=True, default=repr)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class StatusCache(object):
+    """ The cached probe results of working copies, stored between runs in a
+        file next to ``.mr.developer.cfg``. Entries are only valid as long as
+        the kind, URL, other options and fingerprint of the working copy are
+        unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._config = RawConfigParser()
+        self._config.optionxform = lambda s: s
+        self._config.read(path)
+        self.changed = False
+
+    def get(self, source, fingerprint):
+        name = source['name']
+        if not self._config.has_section(name):
+            return None
+        entry = dict(self._config.items(name))
+        if entry.get('kind') != source['kind']:
+            return None
+        if entry.get('url') != source['url']:
+            return None
+        if entry.get('options') != source_digest(source):
+            return None
+        if entry.get('fingerprint') != fingerprint:
+            return None
+        if 'matches' not in entry:
+            return None
+        return entry['matches'] == 'true', entry.get('status')
+
+    def set(self, source, fingerprint, matches, status=None):
+        name = source['name']
+        previous = self.get(source, fingerprint)
+        if self._config.has_section(name):
+            self._config.remove_section(name)
+        self._config.add_section(name)
+        self._config.set(name, 'kind', source['kind'])
+        self._config.set(name, 'url', source['url'])
+        self._config.set(name, 'options', source_digest(source))
+        self._config.set(name, 'fingerprint', fingerprint)
+        self._config.set(name, 'matches', matches and 'true' or 'false')
+        if status is None and previous is not None and previous[0] == matches:
+            status = previous[1]
+        if status is not None:
+            self._config.set(name, 'status', status)
+        self.changed = True
+
+    def invalidate(self, names=None):
+        if names is None:
+            names = self._config.sections()
+        for name in names:
+            if self._config.remove_section(name):
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        if self._config.sections():
+            with open(self.path, "w") as f:
+                self._config.write(f)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.changed = False
+
+
+class Timings(object):
+    """ The durations of the checkouts and updates of packages in previous
+        runs, stored in a file next to ``.mr.developer.cfg``. They are used
+        to start the slowest packages first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._config = RawConfigParser()
+        self._config.optionxform = lambda s: s
+        self._config.read(path)
+        self.changed = False
+
+    def get(self, action, name):
+        with self._lock:
+            if not self._config.has_option(action, name):
+                return None
+            try:
+                return float(self._config.get(action, name))
+            except ValueError:
+                return None
+
+    def set(self, action, name, duration):
+        with self._lock:
+            previous = self.get(action, name)
+            if previous is not None:
+                # smooth out one-off network hiccups
+                duration = (previous + duration) / 2
+            if not self._config.has_section(action):
+                self._config.add_section(action)
+            self._config.set(action, name, '%.3f' % duration)
+            self.changed = True
+
+    def save(self):
+        with self._lock:
+            if not self.changed:
+                return
+            with open(self.path, "w") as f:
+                self._config.write(f)
+            self.changed = False
+
+
 class Config(object):
     def read_config(self, path):
         config = RawConfigParser()
@@ -562,6 +1784,8 @@ class Config(object):
         self.global_cfg_path = os.path.expanduser(global_cfg_name)
         self.options_cfg_path = os.path.join(buildout_dir, options_cfg_name)
         self.cfg_path = os.path.join(buildout_dir, '.mr.developer.cfg')
+        self.status_cache_path = os.path.join(buildout_dir, '.mr.developer-status.cfg')
+        self.timings_path = os.path.join(buildout_dir, '.mr.developer-timings.cfg')
         self.check_invalid_sections(self.global_cfg_path, global_cfg_name)
         self.check_invalid_sections(self.options_cfg_path, options_cfg_name)
         self._config = self.read_config((
@@ -571,6 +1795,9 @@ class Config(object):
         self._legacy_rewrites = []
         self.rewrites = []
         self.threads = 5
+        self.host_threads = {}
+        self.status_cache = False
+        self.timings = False
         if self._config.has_section('develop'):
             for package, value in self._config.items('develop'):
                 value = value.lower()
@@ -613,6 +1840,30 @@ class Config(object):
                     "Invalid value '%s' for 'threads' option, must be a positive number. Using default value of %s.",
                     self._config.get('mr.developer', 'threads'),
                     self.threads)
+        if self._config.has_option('mr.developer', 'host-threads'):
+            try:
+                self.host_threads = parse_host_threads(
+                    self._config.get('mr.developer', 'host-threads'))
+            except ValueError:
+                logger.warning(
+                    "Invalid value '%s' for 'host-threads' option, must be 'host=threads' pairs with a positive number of threads. Not limiting threads per host.",
+                    self._config.get('mr.developer', 'host-threads'))
+        if self._config.has_option('mr.developer', 'status-cache'):
+            status_cache = self._config.get('mr.developer', 'status-cache').lower()
+            if status_cache in ('true', 'yes', 'on'):
+                self.status_cache = True
+            elif status_cache not in ('false', 'no', 'off'):
+                logger.warning(
+                    "Invalid value '%s' for 'status-cache' option, must be 'true' or 'false'.",
+                    status_cache)
+        if self._config.has_option('mr.developer', 'timings'):
+            timings = self._config.get('mr.developer', 'timings').lower()
+            if timings in ('true', 'yes', 'on'):
+                self.timings = True
+            elif timings not in ('false', 'no', 'off'):
+                logger.warning(
+                    "Invalid value '%s' for 'timings' option, must be 'true' or 'false'.",
+                    timings)
         if self._config.has_section('rewrites'):
             for name, rewrite in self._config.items('rewrites'):
                 self.rewrites.append(Rewrite(rewrite))
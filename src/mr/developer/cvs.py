@@ -1,7 +1,6 @@
 from mr.developer import common
 import os
 import re
-import subprocess
 
 logger = common.logger
 
@@ -84,12 +83,12 @@ class CVSWorkingCopy(common.BaseWorkingCopy):
         os.chdir(path)
 
         try:
-            cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = cmd.communicate()
+            returncode, stdout, stderr = common.runner.run(
+                cmd, network=command != 'status')
         finally:
             os.chdir(old_cwd)
 
-        if cmd.returncode != 0:
+        if returncode != 0:
             raise CVSError('CVS %s for %r failed.\n%s' % (command, name, stderr))
         if command == 'tags':
             return self._format_tags_list(stdout)
@@ -110,6 +109,7 @@ class CVSWorkingCopy(common.BaseWorkingCopy):
                     'Source URL for existing package %r differs. '
                     'Expected %r.' % (name, self.source['url']))
         else:
+            self.work = 'checkout'
             return self.cvs_command('checkout', **kwargs)
 
     def matches(self):
@@ -169,6 +169,7 @@ class CVSWorkingCopy(common.BaseWorkingCopy):
         if self.status() != 'clean' and not kwargs.get('force', False):
             raise CVSError(
                 "Can't update package %r, because it's dirty." % name)
+        self.work = 'update'
         return self.cvs_command('update', **kwargs)
 
     def _format_tags_list(self, stdout):
@@ -1,6 +1,5 @@
 from mr.developer import common
 import os
-import subprocess
 
 
 logger = common.logger
@@ -25,9 +24,8 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
             return
         self.output((logger.info, "Getting '%s' with darcs." % name))
         cmd = [self.darcs_executable, "get", "--quiet", "--lazy", url, path]
-        cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(cmd, network=True)
+        if returncode != 0:
             raise DarcsError("darcs get for '%s' failed.\n%s" % (name, stderr))
         if kwargs.get('verbose', False):
             return stdout
@@ -36,12 +34,9 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
         name = self.source['name']
         path = self.source['path']
         self.output((logger.info, "Updating '%s' with darcs." % name))
-        cmd = subprocess.Popen([self.darcs_executable, "pull", "-a"],
-                               cwd=path,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(
+            [self.darcs_executable, "pull", "-a"], cwd=path, network=True)
+        if returncode != 0:
             raise DarcsError("darcs pull for '%s' failed.\n%s" % (name, stderr))
         if kwargs.get('verbose', False):
             return stdout
@@ -58,6 +53,7 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
             else:
                 raise DarcsError("Checkout URL for existing package '%s' differs. Expected '%s'." % (name, self.source['url']))
         else:
+            self.work = 'checkout'
             return self.darcs_checkout(**kwargs)
 
     def _darcs_related_repositories(self):
@@ -68,12 +64,9 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
             for line in open(repos).readlines():
                 yield line.strip()
         else:
-            cmd = subprocess.Popen([self.darcs_executable, "show", "repo"],
-                                   cwd=path,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-            stdout, stderr = cmd.communicate()
-            if cmd.returncode != 0:
+            returncode, stdout, stderr = common.runner.run(
+                [self.darcs_executable, "show", "repo"], cwd=path)
+            if returncode != 0:
                 self.output((logger.error, "darcs info for '%s' failed.\n%s" % (name, stderr)))
                 return
 
@@ -94,11 +87,8 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
 
     def status(self, **kwargs):
         path = self.source['path']
-        cmd = subprocess.Popen([self.darcs_executable, "whatsnew"],
-                               cwd=path,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
+        returncode, stdout, stderr = common.runner.run(
+            [self.darcs_executable, "whatsnew"], cwd=path)
         lines = stdout.strip().split('\n')
         if 'No changes' in lines[-1]:
             status = 'clean'
@@ -115,4 +105,5 @@ class DarcsWorkingCopy(common.BaseWorkingCopy):
             raise DarcsError("Can't update package '%s' because it's URL doesn't match." % name)
         if self.status() != 'clean' and not kwargs.get('force', False):
             raise DarcsError("Can't update package '%s' because it's dirty." % name)
+        self.work = 'update'
         return self.darcs_update(**kwargs)
@@ -1,4 +1,4 @@
-from mr.developer.common import logger, Config, get_commands
+from mr.developer.common import logger, profiler, Config, get_commands
 from mr.developer.commands import CmdHelp
 from mr.developer.extension import Extension
 from zc.buildout.buildout import Buildout
@@ -59,6 +59,8 @@ class Develop(object):
         self.parser.add_argument('-v', '--version',
                                  action='version',
                                  version='mr.developer %s' % version)
+        self.parser.add_argument('--profile', dest='profile', metavar='FILE',
+                                 help="Write the durations of the actions of the working copies and of the VCS commands to FILE, as Chrome trace if it ends with '.json', otherwise as JSON lines.")
         self.parsers = self.parser.add_subparsers(title="commands", metavar="")
 
         for command in get_commands():
@@ -81,6 +83,9 @@ class Develop(object):
 
         self.config = Config(self.buildout_dir)
         self.original_dir = os.getcwd()
+        profile_path = args.profile
+        if profile_path is not None:
+            profile_path = os.path.abspath(os.path.expanduser(profile_path))
         atexit.register(self.restore_original_dir)
         os.chdir(self.buildout_dir)
         buildout = Buildout(self.config.buildout_settings['config_file'],
@@ -99,8 +104,19 @@ class Develop(object):
         self.always_accept_server_certificate = extension.get_always_accept_server_certificate()
         develop, self.develeggs, versions = extension.get_develop_info()
         self.threads = extension.get_threads()
-
-        args.func(args)
+        self.host_threads = extension.get_host_threads()
+        self.engine = extension.get_engine()
+        extension.setup_runner()
+        if profile_path is None:
+            profile_path = extension.get_profile_path()
+        if profile_path is None:
+            args.func(args)
+            return
+        profiler.enable(profile_path)
+        try:
+            args.func(args)
+        finally:
+            profiler.save()
 
     def restore_original_dir(self):
         if os.path.exists(self.original_dir):
@@ -1,4 +1,5 @@
-from mr.developer.common import memoize, WorkingCopies, Config, get_workingcopytypes
+from mr.developer.common import memoize, Config, get_workingcopies_class, get_workingcopytypes
+from mr.developer.common import parse_host_threads, profiler, runner, Timings
 import logging
 import os
 import re
@@ -37,9 +38,18 @@ class Extension(object):
         return Config(self.buildout_dir)
 
     def get_workingcopies(self):
-        return WorkingCopies(
+        return get_workingcopies_class(self.get_engine())(
             self.get_sources(),
-            threads=self.get_threads())
+            threads=self.get_threads(),
+            host_threads=self.get_host_threads(),
+            timings=self.get_timings(),
+            progress=self.get_mrdev_progress())
+
+    def get_timings(self):
+        config = self.get_config()
+        if not config.timings:
+            return None
+        return Timings(config.timings_path)
 
     @memoize
     def get_threads(self):
@@ -48,10 +58,70 @@ class Extension(object):
             self.get_config().threads))
         return threads
 
+    @memoize
+    def get_host_threads(self):
+        host_threads = dict(self.get_config().host_threads)
+        value = self.buildout['buildout'].get('mr.developer-host-threads', '')
+        try:
+            host_threads.update(parse_host_threads(value))
+        except ValueError:
+            logger.error("Invalid value '%s' for mr.developer-host-threads option, must be 'host=threads' pairs." % value)
+            sys.exit(1)
+        return host_threads
+
+    @memoize
+    def get_engine(self):
+        engine = self.buildout['buildout'].get('mr.developer-engine', 'threads')
+        if engine not in ('threads', 'processes'):
+            logger.error("Invalid value '%s' for mr.developer-engine option, must be 'threads' or 'processes'." % engine)
+            sys.exit(1)
+        return engine
+
+    @memoize
+    def get_command_timeout(self):
+        value = self.buildout['buildout'].get('mr.developer-timeout', '')
+        if not value:
+            return None
+        try:
+            timeout = float(value)
+        except ValueError:
+            timeout = 0
+        if timeout <= 0:
+            logger.error("Invalid value '%s' for mr.developer-timeout option, must be a positive number of seconds." % value)
+            sys.exit(1)
+        return timeout
+
+    @memoize
+    def get_command_retries(self):
+        value = self.buildout['buildout'].get('mr.developer-retries', '0')
+        try:
+            retries = int(value)
+        except ValueError:
+            retries = -1
+        if retries < 0:
+            logger.error("Invalid value '%s' for mr.developer-retries option, must be a number." % value)
+            sys.exit(1)
+        return retries
+
+    def setup_runner(self):
+        runner.timeout = self.get_command_timeout()
+        runner.retries = self.get_command_retries()
+
     @memoize
     def get_mrdev_verbose(self):
         return self.buildout['buildout'].get('mr.developer-verbose', '').lower() == 'true'
 
+    @memoize
+    def get_mrdev_progress(self):
+        return self.buildout['buildout'].get('mr.developer-progress', '').lower() == 'true'
+
+    @memoize
+    def get_profile_path(self):
+        path = self.buildout['buildout'].get('mr.developer-profile')
+        if not path:
+            return None
+        return os.path.join(self.buildout_dir, os.path.expanduser(path))
+
     @memoize
     def get_sources_dir(self):
         sources_dir = self.buildout['buildout'].get('sources-dir', 'src')
@@ -128,6 +198,23 @@ class Extension(object):
                         value = True
                     elif value.lower() in ('false', 'no', 'off'):
                         value = False
+                if key == 'git-cache-dir':
+                    value = os.path.join(
+                        self.buildout_dir, os.path.expanduser(value))
+                if key == 'single-branch':
+                    if value.lower() in ('true', 'yes', 'on'):
+                        value = True
+                    elif value.lower() in ('false', 'no', 'off'):
+                        value = False
+                    else:
+                        raise ValueError('single-branch value needs to be true or false.')
+                if key == 'untracked':
+                    if value.lower() in ('true', 'yes', 'on'):
+                        value = True
+                    elif value.lower() in ('false', 'no', 'off'):
+                        value = False
+                    else:
+                        raise ValueError('untracked value needs to be true or false.')
                 if key == 'depth':
                     try:
                         not_used = int(value)  # noqa
@@ -144,6 +231,10 @@ class Extension(object):
                     self.get_git_clone_depth():
                 source['depth'] = self.get_git_clone_depth()
 
+            if 'git-cache-dir' not in source and \
+                    self.get_git_cache_dir():
+                source['git-cache-dir'] = self.get_git_cache_dir()
+
             for rewrite in self.get_config().rewrites:
                 rewrite(source)
 
@@ -187,6 +278,12 @@ class Extension(object):
                 raise ValueError('git-clone-depth needs to be a number.')
         return value
 
+    def get_git_cache_dir(self):
+        value = self.buildout['buildout'].get('git-cache-dir', '')
+        if value:
+            value = os.path.join(self.buildout_dir, os.path.expanduser(value))
+        return value
+
     def get_develop_info(self):
         auto_checkout = self.get_auto_checkout()
         sources = self.get_sources()
@@ -253,7 +350,18 @@ class Extension(object):
         self.buildout['buildout']['parts'] = " ".join(parts)
 
     def __call__(self):
+        profile_path = self.get_profile_path()
+        if profile_path is not None and not profiler.enabled:
+            profiler.enable(profile_path)
+        try:
+            self.run()
+        finally:
+            if profile_path is not None:
+                profiler.save()
+
+    def run(self):
         config = self.get_config()
+        self.setup_runner()
 
         # store arguments when running from buildout
         if os.path.split(self.executable)[1] in ('buildout', 'buildout-script.py'):
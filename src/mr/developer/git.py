@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from mr.developer import common
+import io
 import os
+import six
 import subprocess
 import re
 import sys
+import threading
 
 
 logger = common.logger
@@ -14,6 +17,257 @@ class GitError(common.WCError):
     pass
 
 
+_config_section_re = re.compile(
+    r'\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+_config_key_re = re.compile(r'([A-Za-z][A-Za-z0-9-]*)\s*(=?)')
+_commit_id_re = re.compile(r'^[0-9a-f]{7,64}$')
+_config_escapes = {'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\'}
+
+
+def iter_git_config(text):
+    """Yields ``(section, subsection, key, value)`` tuples of a git config
+    file.
+
+    Section and key names are lower cased, as they are case insensitive in
+    git. Raises ``ValueError`` for anything which can't be parsed.
+
+        >>> list(iter_git_config(
+        ...     '[core]\\n\\tbare = false\\n'
+        ...     '[remote "origin"]  # comment\\n'
+        ...     '\\turl = "git@example.com:egg.git" ; comment\\n'
+        ...     '[Branch.Master]\\n\\tRebase\\n'))
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [('core', None, 'bare', 'false'),
+         ('remote', 'origin', 'url', 'git@example.com:egg.git'),
+         ('branch', 'master', 'rebase', 'true')]
+    """
+    section = subsection = None
+    lines = iter(text.splitlines())
+    for line in lines:
+        line = line.lstrip()
+        if line.startswith('['):
+            m = _config_section_re.match(line)
+            if m is None:
+                raise ValueError("Invalid section header %r." % line)
+            section, subsection = m.groups()
+            if subsection is not None:
+                subsection = re.sub(r'\\(.)', r'\1', subsection)
+            elif '.' in section:
+                section, subsection = section.split('.', 1)
+                subsection = subsection.lower()
+            section = section.lower()
+            line = line[m.end():].lstrip()
+        if not line or line[0] in '#;':
+            continue
+        m = _config_key_re.match(line)
+        if m is None or section is None:
+            raise ValueError("Invalid line %r." % line)
+        key = m.group(1).lower()
+        if not m.group(2):
+            if line[m.end():].strip() and line[m.end():].lstrip()[0] not in '#;':
+                raise ValueError("Invalid line %r." % line)
+            yield (section, subsection, key, 'true')
+            continue
+        value = []
+        quoted = False
+        rest = line[m.end():].lstrip()
+        while True:
+            i = 0
+            while i < len(rest):
+                c = rest[i]
+                if c == '\\':
+                    if i + 1 == len(rest):
+                        # line continuation
+                        break
+                    if rest[i + 1] not in _config_escapes:
+                        raise ValueError("Invalid escape in line %r." % line)
+                    value.append(_config_escapes[rest[i + 1]])
+                    i = i + 2
+                    continue
+                if c == '"':
+                    quoted = not quoted
+                elif c in '#;' and not quoted:
+                    break
+                else:
+                    value.append(c)
+                i = i + 1
+            if i < len(rest) and rest[i] == '\\':
+                try:
+                    rest = next(lines)
+                except StopIteration:
+                    raise ValueError("Unexpected end of file.")
+                continue
+            break
+        if quoted:
+            raise ValueError("Unterminated quote in line %r." % line)
+        yield (section, subsection, key, ''.join(value).strip())
+
+
+def _gitdir_pattern_matches(pattern, config_dir, gitdir, ignorecase):
+    if pattern.startswith('~/'):
+        pattern = os.path.expanduser(pattern)
+    elif pattern.startswith('./'):
+        pattern = os.path.join(config_dir, pattern[2:])
+    elif not os.path.isabs(pattern):
+        pattern = '**/' + pattern
+    if pattern.endswith('/'):
+        pattern = pattern + '**'
+    if '[' in pattern or '\\' in pattern:
+        raise ValueError("Unsupported gitdir pattern %r." % pattern)
+    regexp = []
+    for part in re.split(r'(\*\*/|/\*\*$|\*|\?)', pattern):
+        if part == '**/':
+            regexp.append('(?:.*/)?')
+        elif part == '/**':
+            regexp.append('(?:/.*)?')
+        elif part == '*':
+            regexp.append('[^/]*')
+        elif part == '?':
+            regexp.append('[^/]')
+        else:
+            regexp.append(re.escape(part))
+    flags = re.IGNORECASE if ignorecase else 0
+    gitdir = os.path.realpath(gitdir).replace(os.sep, '/')
+    return re.match(''.join(regexp) + '$', gitdir, flags) is not None
+
+
+def read_git_config(path, gitdir, _depth=0):
+    """Returns a list of ``(section, subsection, key, value)`` tuples from
+    the git config file at ``path``, following ``include.path`` and
+    ``includeIf.gitdir:`` includes the way git does.
+
+    Raises ``ValueError`` for anything this doesn't understand, like other
+    ``includeIf`` conditions, so the caller can ask git itself instead.
+    """
+    if _depth > 10:
+        raise ValueError("Exceeded maximum include depth.")
+    config_dir = os.path.dirname(path)
+    with io.open(path, encoding='utf-8') as f:
+        text = f.read()
+    result = []
+    for section, subsection, key, value in iter_git_config(text):
+        result.append((section, subsection, key, value))
+        if key != 'path':
+            continue
+        if section == 'include' and subsection is None:
+            pass
+        elif section == 'includeif' and subsection is not None:
+            condition, sep, pattern = subsection.partition(':')
+            if condition not in ('gitdir', 'gitdir/i') or not sep:
+                raise ValueError("Unsupported include condition %r." % subsection)
+            if not _gitdir_pattern_matches(pattern, config_dir, gitdir, condition == 'gitdir/i'):
+                continue
+        else:
+            continue
+        include = os.path.expanduser(value)
+        if not os.path.isabs(include):
+            include = os.path.join(config_dir, include)
+        if os.path.exists(include):
+            result.extend(read_git_config(include, gitdir, _depth=_depth + 1))
+    return result
+
+
+def rewrite_url(url, rules, push=False):
+    """ Returns ``url`` rewritten by the longest matching prefix of the
+        ``(base, key, prefix)`` tuples of ``url.<base>.insteadOf`` and, for
+        ``push``, ``url.<base>.pushInsteadOf`` rules, or ``None`` if none
+        matches.
+
+        >>> rules = [
+        ...     ('https://github.com/', 'insteadof', 'gh:'),
+        ...     ('git@github.com:', 'pushinsteadof', 'https://github.com/')]
+        >>> rewrite_url('gh:egg.git', rules)
+        'https://github.com/egg.git'
+        >>> rewrite_url('https://github.com/egg.git', rules, push=True)
+        'git@github.com:egg.git'
+        >>> rewrite_url('https://github.com/egg.git', rules) is None
+        True
+    """
+    key = 'pushinsteadof' if push else 'insteadof'
+    matches = [
+        (len(prefix), base, prefix) for base, k, prefix in rules
+        if k == key and url.startswith(prefix)]
+    if not matches:
+        return None
+    length, base, prefix = max(matches)
+    return base + url[length:]
+
+
+def effective_urls(entries, rules):
+    """ Returns the URLs of the ``(key, url)`` ``entries`` of a remote,
+        followed by the ones git actually uses for them after applying the
+        ``insteadOf`` and ``pushInsteadOf`` ``rules``, see ``rewrite_url``.
+    """
+    urls = [url for key, url in entries]
+    if not rules:
+        return urls
+    has_pushurl = any(key == 'pushurl' for key, url in entries)
+    rewritten = []
+    for key, url in entries:
+        rewritten.append(rewrite_url(url, rules))
+        if key == 'url' and not has_pushurl:
+            # git pushes to the url with pushInsteadOf if there is no pushurl
+            rewritten.append(rewrite_url(url, rules, push=True))
+    for url in rewritten:
+        if url is not None and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def parse_url_rules(lines):
+    """ Returns the ``(base, key, prefix)`` tuples of the ``url.<base>.*``
+        lines of ``git config --get-regexp`` output.
+
+        >>> parse_url_rules([
+        ...     'url.https://github.com/.insteadof gh:',
+        ...     'remote.origin.url gh:egg.git'])
+        [('https://github.com/', 'insteadof', 'gh:')]
+    """
+    rules = []
+    for line in lines:
+        name, sep, value = line.partition(' ')
+        if not name.startswith('url.') or not sep:
+            continue
+        base, sep, key = name[4:].rpartition('.')
+        if key in ('insteadof', 'pushinsteadof'):
+            rules.append((base, key, value))
+    return rules
+
+
+def mirror_path(cache_dir, url):
+    """ Returns the path of the bare mirror for ``url`` in ``cache_dir``.
+
+        >>> mirror_path('/cache', 'git@github.com:fschulze/mr.developer.git')
+        '/cache/github.com/fschulze/mr.developer.git'
+        >>> mirror_path('/cache', 'file:///srv/repos/foo')
+        '/cache/local/srv/repos/foo.git'
+    """
+    host = common.url_host(url)
+    if '://' in url:
+        path = six.moves.urllib.parse.urlsplit(url).path
+    elif host is not None:
+        path = url.split(':', 1)[1]
+    else:
+        path = url
+    parts = [
+        x for x in re.split(r'[/\\:]+', path)
+        if x and x not in ('.', '..', '~')]
+    if not parts:
+        parts = ['repository']
+    if not parts[-1].endswith('.git'):
+        parts[-1] += '.git'
+    return os.path.join(cache_dir, host or 'local', *parts)
+
+
+# the mirrors in the git cache which were already updated in this run,
+# mapped to whether they can be used. This is per process, so with the
+# processes engine each worker fetches a mirror again when it is used by
+# another package.
+_mirrors = {}
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
+
 class GitWorkingCopy(common.BaseWorkingCopy):
     """The git working copy.
 
@@ -28,6 +282,10 @@ class GitWorkingCopy(common.BaseWorkingCopy):
     # should make master and a lot of other conventional stuff configurable
     _upstream_name = "origin"
 
+    _fingerprint_files = (
+        '.git/index', '.git/HEAD', '.git/config', '.git/packed-refs',
+        '.git/FETCH_HEAD', '.git/refs/heads', '.git/refs/remotes/origin')
+
     def __init__(self, source):
         self.git_executable = common.which('git')
         if 'rev' in source and 'revision' in source:
@@ -43,9 +301,14 @@ class GitWorkingCopy(common.BaseWorkingCopy):
                          source['branch'], source['rev'], source['name'])
             sys.exit(1)
         super(GitWorkingCopy, self).__init__(source)
+        self._probe = None
+        self._refs = {}
 
-    @common.memoize
     def git_version(self):
+        return common.tool_cache.get(
+            ('version', self.git_executable), self._git_version)
+
+    def _git_version(self):
         cmd = self.run_git(['--version'])
         stdout, stderr = cmd.communicate()
         if cmd.returncode != 0:
@@ -90,44 +353,106 @@ class GitWorkingCopy(common.BaseWorkingCopy):
         else:
             return 'remotes/%s' % self._upstream_name
 
-    def run_git(self, commands, **kwargs):
-        commands.insert(0, self.git_executable)
+    def run_git(self, commands, network=False, **kwargs):
+        commands = [self.git_executable] + list(commands)
         kwargs['stdout'] = subprocess.PIPE
         kwargs['stderr'] = subprocess.PIPE
         # This should ease things up when multiple processes are trying to send
         # back to the main one large chunks of output
         kwargs['bufsize'] = -1
         kwargs['universal_newlines'] = True
-        return subprocess.Popen(commands, **kwargs)
+        return common.runner.popen(commands, network=network, **kwargs)
+
+    def run_git_streamed(self, commands, network=False, target=None, **kwargs):
+        """ Runs git like ``run_git``, but forwards the output to the
+            ``stream`` of the working copy as it arrives. Returns the exit
+            code and the end of the error output. Commands which access the
+            ``network`` are retried by ``common.runner``, a partial
+            ``target`` directory of a clone is removed before retrying.
+        """
+        def run():
+            cmd = self.run_git(commands, network=network, **kwargs)
+            stderr = common.stream_process(cmd, self.stream)
+            return (cmd.returncode, stderr)
 
-    def git_merge_rbranch(self, stdout_in, stderr_in, accept_missing=False):
+        return common.runner.retry(run, network=network, target=target)
+
+    def _branch_refs(self, branch):
+        """ Returns the set of the existing local and remote tracking refs of
+            ``branch``. They are looked up once and cached on the working
+            copy, instead of listing all branches of the repository.
+        """
+        if branch not in self._refs:
+            local = 'refs/heads/%s' % branch
+            remote = 'refs/remotes/%s/%s' % (self._upstream_name, branch)
+            cmd = self.run_git(
+                ["for-each-ref", "--format=%(refname)", local, remote],
+                cwd=self.source['path'])
+            stdout, stderr = cmd.communicate()
+            if cmd.returncode != 0:
+                raise GitError("'git for-each-ref' failed.\n%s" % stderr)
+            # the patterns also match refs below them, like 'branch/other'
+            self._refs[branch] = set(stdout.split()) & set((local, remote))
+        return self._refs[branch]
+
+    def git_merge_rbranch(self, accept_missing=False):
         path = self.source['path']
         branch = self.source.get('branch', 'master')
 
-        cmd = self.run_git(["branch", "-a"], cwd=path)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
-            raise GitError("'git branch -a' failed.\n%s" % stderr)
-        stdout_in += stdout
-        stderr_in += stderr
-        if not re.search(r"^(\*| ) %s$" % re.escape(branch), stdout, re.M):
+        if 'refs/heads/%s' % branch not in self._branch_refs(branch):
             # The branch is not local.  We should not have reached
             # this, unless no branch was specified and we guess wrong
             # that it should be master.
             if accept_missing:
                 logger.info("No such branch %r", branch)
-                return (stdout_in, stderr_in)
+                return
             else:
                 logger.error("No such branch %r", branch)
                 sys.exit(1)
 
         rbp = self._remote_branch_prefix
-        cmd = self.run_git(["merge", "%s/%s" % (rbp, branch)], cwd=path)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stderr = self.run_git_streamed(["merge", "%s/%s" % (rbp, branch)], cwd=path)
+        if returncode != 0:
             raise GitError("git merge of remote branch 'origin/%s' failed.\n%s" % (branch, stderr))
-        return (stdout_in + stdout,
-                stderr_in + stderr)
+
+    def git_mirror(self):
+        """ Returns the path of an up to date bare mirror of the repository
+            in the ``git-cache-dir`` of the source, or ``None`` if there is
+            none. Each mirror is cloned or fetched only once per run.
+        """
+        cache_dir = self.source.get('git-cache-dir')
+        if not cache_dir or self.git_version() < (2, 11):
+            return None
+        url = self.source['url']
+        mirror = mirror_path(cache_dir, url)
+        with _mirror_locks_lock:
+            lock = _mirror_locks.setdefault(mirror, threading.Lock())
+        with lock:
+            if mirror in _mirrors:
+                return mirror if _mirrors[mirror] else None
+            if os.path.exists(mirror):
+                args, cwd = ["fetch", "--prune", "--quiet"], mirror
+            else:
+                parent = os.path.dirname(mirror)
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                args, cwd = ["clone", "--mirror", "--quiet", url, mirror], None
+
+            def run():
+                cmd = self.run_git(args, cwd=cwd, network=True)
+                stdout, stderr = cmd.communicate()
+                return (cmd.returncode, stderr)
+
+            try:
+                returncode, stderr = common.runner.retry(
+                    run, network=True, target=mirror if cwd is None else None)
+            except common.CommandTimeoutError:
+                returncode, stderr = None, sys.exc_info()[1].args[0]
+            _mirrors[mirror] = returncode == 0
+            if returncode != 0:
+                self.output((logger.warning, "Updating the git cache in '%s' failed, not using it.\n%s" % (mirror, stderr)))
+                return None
+            return mirror
 
     def git_checkout(self, **kwargs):
         name = self.source['name']
@@ -136,39 +461,83 @@ class GitWorkingCopy(common.BaseWorkingCopy):
         if os.path.exists(path):
             self.output((logger.info, "Skipped cloning of existing package '%s'." % name))
             return
+        self._probe = None
+        self._refs = {}
         msg = "Cloned '%s' with git" % name
         if "branch" in self.source:
             msg += " using branch '%s'" % self.source['branch']
         msg += " from '%s'." % url
         self.output((logger.info, msg))
-        args = ["clone", "--quiet"]
+        args = ["clone", "--quiet"] + self._progress_args()
+        mirror = self.git_mirror()
+        if mirror is not None:
+            args.extend(["--reference-if-able", mirror, "--dissociate"])
         if 'depth' in self.source:
             args.extend(["--depth", self.source["depth"]])
+        args.extend(self._partial_clone_args())
+        if self.source.get('single-branch', False):
+            args.append("--single-branch")
+        if 'sparse' in self.source:
+            self._require_git_version('sparse', (2, 25))
+            args.append("--sparse")
         if "branch" in self.source:
             args.extend(["-b", self.source["branch"]])
         args.extend([url, path])
-        cmd = self.run_git(args)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stderr = self.run_git_streamed(args, network=True, target=path)
+        if returncode != 0:
             raise GitError("git cloning of '%s' failed.\n%s" % (name, stderr))
+        if 'sparse' in self.source:
+            self.git_sparse_checkout()
         if 'rev' in self.source:
-            stdout, stderr = self.git_switch_branch(stdout, stderr)
+            self.git_switch_branch()
         if 'pushurl' in self.source:
-            stdout, stderr = self.git_set_pushurl(stdout, stderr)
+            self.git_set_pushurl()
 
         update_git_submodules = self.source.get('submodules', kwargs['submodules'])
         if update_git_submodules in ['always', 'checkout']:
-            stdout, stderr, initialized = self.git_init_submodules(stdout, stderr)
+            initialized = self.git_init_submodules()
             # Update only new submodules that we just registered. this is for safety reasons
             # as git submodule update on modified submodules may cause code loss
+            self.git_update_new_submodules(initialized, jobs=kwargs.get('jobs', 1))
             for submodule in initialized:
-                stdout, stderr = self.git_update_submodules(stdout, stderr, submodule=submodule)
                 self.output((logger.info, "Initialized '%s' submodule at '%s' with git." % (name, submodule)))
 
-        if kwargs.get('verbose', False):
-            return stdout
-
-    def git_switch_branch(self, stdout_in, stderr_in, accept_missing=False):
+    def _require_git_version(self, option, version):
+        if self.git_version() < version:
+            raise GitError(
+                "The '%s' option of '%s' requires git %s or newer." % (
+                    option, self.source['name'],
+                    ".".join(str(x) for x in version)))
+
+    def _partial_clone_args(self):
+        if 'filter' not in self.source:
+            return []
+        self._require_git_version('filter', (2, 19))
+        return ["--filter=%s" % self.source['filter']]
+
+    def git_sparse_checkout(self):
+        """ Restricts the working tree to the comma separated paths of the
+            ``sparse`` option.
+
+            The paths are directories in cone mode, which ``set`` only
+            defaults to since git 2.37 and only accepts ``--cone`` for since
+            git 2.35, before that it's enabled with ``init --cone``.
+        """
+        path = self.source['path']
+        paths = [x.strip() for x in self.source['sparse'].split(',') if x.strip()]
+        if self.git_version() < (2, 35):
+            returncode, stderr = self.run_git_streamed(
+                ["sparse-checkout", "init", "--cone"], cwd=path)
+            argv = ["sparse-checkout", "set"]
+        else:
+            returncode = 0
+            argv = ["sparse-checkout", "set", "--cone"]
+        if returncode == 0:
+            returncode, stderr = self.run_git_streamed(argv + paths, cwd=path)
+        if returncode != 0:
+            raise GitError("git sparse-checkout of '%s' failed.\n%s" % (self.source['name'], stderr))
+
+    def git_switch_branch(self, accept_missing=False):
         """Switch branches.
 
         If accept_missing is True, we do not switch the branch if it
@@ -176,76 +545,143 @@ class GitWorkingCopy(common.BaseWorkingCopy):
         """
         path = self.source['path']
         branch = self.source.get('branch', 'master')
-        rbp = self._remote_branch_prefix
-        cmd = self.run_git(["branch", "-a"], cwd=path)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
-            raise GitError("'git branch -a' failed.\n%s" % stderr)
-        stdout_in += stdout
-        stderr_in += stderr
         if 'rev' in self.source:
             # A tag or revision was specified instead of a branch
             argv = ["checkout", self.source['rev']]
             self.output((logger.info, "Switching to rev '%s'." % self.source['rev']))
-        elif re.search(r"^(\*| ) %s$" % re.escape(branch), stdout, re.M):
+        elif 'refs/heads/%s' % branch in self._branch_refs(branch):
             # the branch is local, normal checkout will work
             argv = ["checkout", branch]
             self.output((logger.info, "Switching to branch '%s'." % branch))
-        elif re.search(
-                "^  " + re.escape(rbp) + r"\/" + re.escape(branch) + "$",
-                stdout, re.M):
+        elif 'refs/remotes/%s/%s' % (self._upstream_name, branch) in self._branch_refs(branch):
             # the branch is not local, normal checkout won't work here
-            rbranch = "%s/%s" % (rbp, branch)
+            rbranch = "%s/%s" % (self._remote_branch_prefix, branch)
             argv = ["checkout", "-b", branch, rbranch]
             self.output((logger.info, "Switching to remote branch '%s'." % rbranch))
         elif accept_missing:
             self.output((logger.info, "No such branch %r", branch))
-            return (stdout_in + stdout,
-                    stderr_in + stderr)
+            return
         else:
             self.output((logger.error, "No such branch %r", branch))
             sys.exit(1)
         # runs the checkout with predetermined arguments
-        cmd = self.run_git(argv, cwd=path)
+        returncode, stderr = self.run_git_streamed(argv, cwd=path)
+        if returncode != 0:
+            raise GitError("git checkout of branch '%s' failed.\n%s" % (branch, stderr))
+        if "-b" in argv:
+            self._branch_refs(branch).add('refs/heads/%s' % branch)
+
+    def _progress_args(self):
+        """ Asks git to report its progress, which is shown by
+            ``common.Progress``, even though the output isn't a terminal.
+        """
+        if self.stream.progress:
+            return ["--progress"]
+        return []
+
+    def git_fetch(self):
+        argv = ["fetch"] + self._progress_args() + self._partial_clone_args()
+        if self.source.get('single-branch', False) and 'branch' in self.source:
+            # the refspec of a single branch clone only covers the branch it
+            # was cloned with, so fetch the configured one explicitly
+            argv.extend([
+                self._upstream_name,
+                "+refs/heads/%s:refs/remotes/%s/%s" % (
+                    self.source['branch'], self._upstream_name,
+                    self.source['branch'])])
+        returncode, stderr = self.run_git_streamed(
+            argv, cwd=self.source['path'], network=True)
+        if returncode != 0:
+            raise GitError("git fetch of '%s' failed.\n%s" % (self.source['name'], stderr))
+
+    def _local_rev(self):
+        """ Returns the commit ids of ``HEAD`` and of the pinned ``rev``, or
+            ``None`` if the rev isn't a commit id or tag which is available
+            locally. Branch names are never resolved locally, as the remote
+            branch may have moved.
+        """
+        rev = self.source['rev']
+        if _commit_id_re.match(rev) is None:
+            rev = 'refs/tags/%s' % rev
+        cmd = self.run_git(
+            ["rev-parse", "HEAD", "%s^{commit}" % rev, "--"],
+            cwd=self.source['path'])
         stdout, stderr = cmd.communicate()
         if cmd.returncode != 0:
-            raise GitError("git checkout of branch '%s' failed.\n%s" % (branch, stderr))
-        return (stdout_in + stdout,
-                stderr_in + stderr)
+            return None
+        lines = stdout.split()
+        return (lines[0], lines[1])
+
+    def git_fetch_rev(self):
+        """ Makes sure the pinned ``rev`` is available locally and returns
+            whether ``HEAD`` already points to it.
+
+            Nothing is fetched if the rev is already there, otherwise only
+            the commit or tag is fetched, if that fails everything is. A rev
+            naming a known remote branch is fetched with everything else.
+        """
+        local_rev = self._local_rev()
+        if local_rev is not None:
+            head, commit = local_rev
+            return head == commit
+        rev = self.source['rev']
+        remote = 'refs/remotes/%s/%s' % (self._upstream_name, rev)
+        if _commit_id_re.match(rev) is None:
+            if remote in self._branch_refs(rev):
+                refspec = None
+            else:
+                refspec = "+refs/tags/%s:refs/tags/%s" % (rev, rev)
+        elif len(rev) in (40, 64):
+            refspec = rev
+        else:
+            # servers only allow fetching complete commit ids
+            refspec = None
+        if refspec is not None:
+            argv = ["fetch"] + self._progress_args() + self._partial_clone_args()
+            argv.extend([self._upstream_name, refspec])
+            returncode, stderr = self.run_git_streamed(
+                argv, cwd=self.source['path'], network=True)
+            if returncode == 0:
+                return False
+        self.git_fetch()
+        # the fetch may have added the branch
+        self._refs.pop(rev, None)
+        return False
 
     def git_update(self, **kwargs):
         name = self.source['name']
-        path = self.source['path']
         self.output((logger.info, "Updated '%s' with git." % name))
-        # First we fetch.  This should always be possible.
-        argv = ["fetch"]
-        cmd = self.run_git(argv, cwd=path)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
-            raise GitError("git fetch of '%s' failed.\n%s" % (name, stderr))
+        self._probe = None
+        self._refs = {}
         if 'rev' in self.source:
-            stdout, stderr = self.git_switch_branch(stdout, stderr)
+            at_rev = self.git_fetch_rev()
+        else:
+            # First we fetch.  This should always be possible.
+            self.git_fetch()
+        if 'sparse' in self.source:
+            self._require_git_version('sparse', (2, 25))
+            self.git_sparse_checkout()
+        if 'rev' in self.source:
+            if not at_rev:
+                self.git_switch_branch()
         elif 'branch' in self.source:
-            stdout, stderr = self.git_switch_branch(stdout, stderr)
-            stdout, stderr = self.git_merge_rbranch(stdout, stderr)
+            self.git_switch_branch()
+            self.git_merge_rbranch()
         else:
             # We may have specified a branch previously but not
             # anymore.  In that case, we want to revert to master.
-            stdout, stderr = self.git_switch_branch(stdout, stderr, accept_missing=True)
-            stdout, stderr = self.git_merge_rbranch(stdout, stderr, accept_missing=True)
+            self.git_switch_branch(accept_missing=True)
+            self.git_merge_rbranch(accept_missing=True)
 
         update_git_submodules = self.source.get('submodules', kwargs['submodules'])
         if update_git_submodules in ['always']:
-            stdout, stderr, initialized = self.git_init_submodules(stdout, stderr)
+            initialized = self.git_init_submodules()
             # Update only new submodules that we just registered. this is for safety reasons
             # as git submodule update on modified subomdules may cause code loss
+            self.git_update_new_submodules(initialized, jobs=kwargs.get('jobs', 1))
             for submodule in initialized:
-                stdout, stderr = self.git_update_submodules(stdout, stderr, submodule=submodule)
                 self.output((logger.info, "Initialized '%s' submodule at '%s' with git." % (name, submodule)))
 
-        if kwargs.get('verbose', False):
-            return stdout
-
     def checkout(self, **kwargs):
         name = self.source['name']
         path = self.source['path']
@@ -258,36 +694,200 @@ class GitWorkingCopy(common.BaseWorkingCopy):
             else:
                 self.output((logger.warning, "Checkout URL for existing package '%s' differs. Expected '%s'." % (name, self.source['url'])))
         else:
+            self.work = 'checkout'
             return self.git_checkout(**kwargs)
 
-    def status(self, **kwargs):
+    def _parse_porcelain_status(self, stdout):
+        probe = dict(branch=None, ahead=0, behind=0, dirty=False)
+        for line in stdout.splitlines():
+            if line.startswith('# branch.head '):
+                head = line[len('# branch.head '):]
+                if head != '(detached)':
+                    probe['branch'] = head
+            elif line.startswith('# branch.ab '):
+                ahead, behind = line[len('# branch.ab '):].split()
+                probe['ahead'] = int(ahead[1:])
+                probe['behind'] = int(behind[1:])
+            elif line and not line.startswith('#'):
+                probe['dirty'] = True
+        return probe
+
+    def _parse_short_status(self, stdout):
+        probe = dict(branch=None, ahead=0, behind=0, dirty=False)
+        lines = stdout.strip().split('\n')
+        m = re.match(r"## (?:Initial commit on |No commits yet on )?(.+?)(?:\.\.\.|$| \[)", lines[0])
+        if m is not None and m.group(1) != 'HEAD (no branch)':
+            probe['branch'] = m.group(1)
+        m = re.search(r"\[.*ahead (\d+)", lines[0])
+        if m is not None:
+            probe['ahead'] = int(m.group(1))
+        m = re.search(r"\[.*behind (\d+)", lines[0])
+        if m is not None:
+            probe['behind'] = int(m.group(1))
+        probe['dirty'] = len(lines) > 1
+        return probe
+
+    def _git_dirs(self):
+        gitdir = os.path.join(self.source['path'], '.git')
+        if os.path.isfile(gitdir):
+            # worktrees and submodules have a file pointing to the real one
+            with io.open(gitdir, encoding='utf-8') as f:
+                content = f.read().strip()
+            if not content.startswith('gitdir:'):
+                raise ValueError("Invalid .git file in '%s'." % self.source['path'])
+            gitdir = os.path.join(self.source['path'], content[len('gitdir:'):].strip())
+        commondir = gitdir
+        commondir_file = os.path.join(gitdir, 'commondir')
+        if os.path.exists(commondir_file):
+            with io.open(commondir_file, encoding='utf-8') as f:
+                commondir = os.path.join(gitdir, f.read().strip())
+        return gitdir, commondir
+
+    def _read_remote_urls(self):
+        for var in ('GIT_DIR', 'GIT_CONFIG', 'GIT_CONFIG_COUNT', 'GIT_CONFIG_PARAMETERS'):
+            if var in os.environ:
+                raise ValueError("The %s environment variable is set." % var)
+        gitdir, commondir = self._git_dirs()
+        paths = [os.path.join(commondir, 'config')]
+        if os.path.exists(os.path.join(gitdir, 'config.worktree')):
+            paths.append(os.path.join(gitdir, 'config.worktree'))
+        entries = []
+        rules = list(self._global_url_rules())
+        for path in paths:
+            for section, subsection, key, value in read_git_config(path, gitdir):
+                if section == 'url' and key in ('insteadof', 'pushinsteadof'):
+                    rules.append((subsection, key, value))
+                if section != 'remote' or subsection != self._upstream_name:
+                    continue
+                if key in ('url', 'pushurl'):
+                    entries.append((key, value))
+        return effective_urls(entries, rules)
+
+    def _global_url_rules(self):
+        """ Returns the ``url.<base>.insteadOf`` and ``pushInsteadOf`` rules
+            of the system and global git config, see ``rewrite_url``. They
+            are looked up once per run.
+        """
+        key = ('url rules', self.git_executable) + tuple(
+            os.environ.get(x) for x in (
+                'HOME', 'XDG_CONFIG_HOME', 'GIT_CONFIG_GLOBAL',
+                'GIT_CONFIG_SYSTEM', 'GIT_CONFIG_NOSYSTEM'))
+        return common.tool_cache.get(key, self._read_global_url_rules)
+
+    def _read_global_url_rules(self):
+        rules = []
+        for scope in ('--system', '--global'):
+            returncode, stdout, stderr = common.runner.run(
+                [
+                    self.git_executable, "config", scope, "--includes",
+                    "--get-regexp", r"^url\..*\.(push)?insteadof$"],
+                universal_newlines=True)
+            # git config exits with 1 if there is no matching key and with
+            # other codes if the file of the scope doesn't exist
+            if returncode == 0:
+                rules.extend(parse_url_rules(stdout.splitlines()))
+        return rules
+
+    def git_remote_urls(self):
+        name = self.source['name']
         path = self.source['path']
-        cmd = self.run_git(["status", "-s", "-b"], cwd=path)
+        # reading the config directly saves spawning a process, if that
+        # isn't possible we let git do the work
+        try:
+            return self._read_remote_urls()
+        except (IOError, OSError, ValueError):
+            logger.debug(
+                "Falling back to 'git config' for '%s': %s" % (
+                    name, sys.exc_info()[1]))
+        cmd = self.run_git(
+            [
+                "config", "--get-regexp",
+                r"^(remote\.%s\.(push)?url|url\..*\.(push)?insteadof)$" % (
+                    re.escape(self._upstream_name))],
+            cwd=path)
         stdout, stderr = cmd.communicate()
-        lines = stdout.strip().split('\n')
-        if len(lines) == 1:
-            if 'ahead' in lines[0]:
-                status = 'ahead'
-            else:
-                status = 'clean'
+        # git config exits with 1 if there is no matching key
+        if cmd.returncode not in (0, 1):
+            raise GitError("git config of '%s' failed.\n%s" % (name, stderr))
+        lines = [x for x in stdout.splitlines() if ' ' in x]
+        entries = [
+            (x.split(None, 1)[0].rpartition('.')[2], x.split(None, 1)[1])
+            for x in lines if x.startswith('remote.')]
+        return effective_urls(entries, parse_url_rules(lines))
+
+    def git_probe(self, verbose=False):
+        """Returns a dictionary with the upstream ``urls``, the current
+        ``branch``, the ``ahead`` and ``behind`` commit counts and whether the
+        working copy is ``dirty``.
+
+        The result is gathered with a single ``git status`` run and a read of
+        the remote configuration and is cached until the next git operation
+        changing the working copy. With git 2.15 or newer the status is
+        stopped at the first change. In ``verbose`` mode the human readable
+        status output is included as ``output``.
+        """
+        if self._probe is not None:
+            if not verbose or 'output' in self._probe:
+                return self._probe
+        path = self.source['path']
+        if verbose or self.git_version() < (2, 15):
+            cmd = self.run_git(self._probe_args(verbose), cwd=path)
+            stdout, stderr = cmd.communicate()
+            returncode = cmd.returncode
+        else:
+            # the status is stopped early, so it must not write the index
+            env = common.environment(GIT_OPTIONAL_LOCKS='0')
+            cmd = self.run_git(self._probe_args(verbose), cwd=path, env=env)
+            # the branch information comes first, after that we only need
+            # to know whether there is any change
+            stdout, stderr, returncode = common.read_until(
+                cmd, lambda line: line.strip() and not line.startswith('#'))
+            if returncode is None:
+                returncode = 0
+        return self._probe_result(verbose, returncode, stdout, stderr)
+
+    def _probe_args(self, verbose):
+        args = ["status"]
+        if not self.source.get('untracked', True):
+            args.append("--untracked-files=no")
+        if verbose or self.git_version() < (2, 11):
+            return args + ["-s", "-b"]
+        return args + ["--porcelain=v2", "--branch"]
+
+    def _probe_result(self, verbose, returncode, stdout, stderr):
+        """ Builds and caches the result of ``git_probe`` from the output of
+            the command returned by ``_probe_args``.
+        """
+        if returncode != 0:
+            raise GitError("git status of '%s' failed.\n%s" % (self.source['name'], stderr))
+        if verbose or self.git_version() < (2, 11):
+            probe = self._parse_short_status(stdout)
+            probe['output'] = stdout
+        else:
+            probe = self._parse_porcelain_status(stdout)
+        if self._probe is not None:
+            probe['urls'] = self._probe['urls']
         else:
+            probe['urls'] = self.git_remote_urls()
+        self._probe = probe
+        return probe
+
+    def status(self, **kwargs):
+        verbose = kwargs.get('verbose', False)
+        probe = self.git_probe(verbose=verbose)
+        if probe['dirty']:
             status = 'dirty'
-        if kwargs.get('verbose', False):
-            return status, stdout
+        elif probe['ahead']:
+            status = 'ahead'
+        else:
+            status = 'clean'
+        if verbose:
+            return status, probe['output']
         else:
             return status
 
     def matches(self):
-        name = self.source['name']
-        path = self.source['path']
-        # This is the old matching code: it does not work on 1.5 due to the
-        # lack of the -v switch
-        cmd = self.run_git(["remote", "show", "-n", self._upstream_name],
-                           cwd=path)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
-            raise GitError("git remote of '%s' failed.\n%s" % (name, stderr))
-        return (self.source['url'] in stdout.split())
+        return (self.source['url'] in self.git_probe()['urls'])
 
     def update(self, **kwargs):
         name = self.source['name']
@@ -295,28 +895,29 @@ class GitWorkingCopy(common.BaseWorkingCopy):
             self.output((logger.warning, "Can't update package '%s' because its URL doesn't match." % name))
         if self.status() != 'clean' and not kwargs.get('force', False):
             raise GitError("Can't update package '%s' because it's dirty." % name)
+        self.work = 'update'
         return self.git_update(**kwargs)
 
-    def git_set_pushurl(self, stdout_in, stderr_in):
-        cmd = self.run_git(
+    def git_set_pushurl(self):
+        returncode, stderr = self.run_git_streamed(
             [
                 "config",
                 "remote.%s.pushurl" % self._upstream_name,
                 self.source['pushurl']],
             cwd=self.source['path'])
-        stdout, stderr = cmd.communicate()
 
-        if cmd.returncode != 0:
+        if returncode != 0:
             raise GitError("git config remote.%s.pushurl %s \nfailed.\n" % (self._upstream_name, self.source['pushurl']))
-        return (stdout_in + stdout, stderr_in + stderr)
 
-    def git_init_submodules(self, stdout_in, stderr_in):
+    def git_init_submodules(self):
         cmd = self.run_git(
             [
                 'submodule',
                 'init'],
             cwd=self.source['path'])
         stdout, stderr = cmd.communicate()
+        self.stream.write(stdout)
+        self.stream.write(stderr)
         if cmd.returncode != 0:
             raise GitError("git submodule init failed.\n")
         output = stdout
@@ -325,19 +926,32 @@ class GitWorkingCopy(common.BaseWorkingCopy):
         initialized_submodules = re.findall(
             r'\s+[\'"](.*?)[\'"]\s+\(.+\)',
             output)
-        return (stdout_in + stdout, stderr_in + stderr, initialized_submodules)
+        return initialized_submodules
+
+    def git_update_new_submodules(self, submodules, jobs=1):
+        """ Updates the given newly initialized ``submodules``. With git 2.9
+            or newer this is done by one command running up to ``jobs``
+            updates in parallel, otherwise one after the other.
+        """
+        if len(submodules) > 1 and self.git_version() >= (2, 9):
+            return self.git_update_submodules(submodule=submodules, jobs=jobs)
+        for submodule in submodules:
+            self.git_update_submodules(submodule=submodule)
 
-    def git_update_submodules(self, stdout_in, stderr_in, submodule='all'):
+    def git_update_submodules(self, submodule='all', jobs=1):
         params = ['submodule',
                   'update']
         if self._always_allow_file_protocol:
             params[0:0] = ["-c", "protocol.file.allow=always"]
-        if submodule != 'all':
+        if jobs > 1:
+            params.extend(['--jobs', str(jobs)])
+        if isinstance(submodule, list):
+            params.extend(submodule)
+        elif submodule != 'all':
             params.append(submodule)
-        cmd = self.run_git(
+        returncode, stderr = self.run_git_streamed(
             params,
-            cwd=self.source['path'])
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+            cwd=self.source['path'],
+            network=True)
+        if returncode != 0:
             raise GitError("git submodule update failed.\n")
-        return (stdout_in + stdout, stderr_in + stderr)
@@ -1,6 +1,5 @@
 from mr.developer import common
 from mr.developer.svn import SVNWorkingCopy
-import subprocess
 
 
 logger = common.logger
@@ -11,6 +10,8 @@ class GitSVNError(common.WCError):
 
 
 class GitSVNWorkingCopy(SVNWorkingCopy):
+    _fingerprint_files = SVNWorkingCopy._fingerprint_files + (
+        '.git/index', '.git/HEAD', '.git/refs/heads')
 
     def __init__(self, source):
         super(GitSVNWorkingCopy, self).__init__(source)
@@ -20,13 +21,10 @@ class GitSVNWorkingCopy(SVNWorkingCopy):
         name = self.source['name']
         path = self.source['path']
         self.output((logger.info, "Gitified '%s'." % name))
-        cmd = subprocess.Popen(
+        returncode, stdout, stderr = common.runner.run(
             [self.gitify_executable, "init"],
-            cwd=path,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+            cwd=path, network=True)
+        if returncode != 0:
             raise GitSVNError("gitify init for '%s' failed.\n%s" % (name, stdout))
         if kwargs.get('verbose', False):
             return stdout
@@ -43,13 +41,11 @@ class GitSVNWorkingCopy(SVNWorkingCopy):
         name = self.source['name']
         path = self.source['path']
         self.output((logger.info, "Updated '%s' with gitify." % name))
-        cmd = subprocess.Popen(
+        self.work = 'update'
+        returncode, stdout, stderr = common.runner.run(
             [self.gitify_executable, "update"],
-            cwd=path,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+            cwd=path, network=True)
+        if returncode != 0:
             raise GitSVNError("gitify update for '%s' failed.\n%s" % (name, stdout))
         if kwargs.get('verbose', False):
             return stdout
@@ -2,7 +2,6 @@ from mr.developer import common
 from mr.developer.compat import b
 import re
 import os
-import subprocess
 
 logger = common.logger
 
@@ -12,6 +11,10 @@ class MercurialError(common.WCError):
 
 
 class MercurialWorkingCopy(common.BaseWorkingCopy):
+    _fingerprint_files = (
+        '.hg/dirstate', '.hg/hgrc', '.hg/bookmarks',
+        '.hg/store/00changelog.i', '.hg/store/phaseroots',
+        '.hg/logexchange/branches')
 
     def __init__(self, source):
         self.hg_executable = common.which('hg')
@@ -19,6 +22,36 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
         source.setdefault('rev')
         super(MercurialWorkingCopy, self).__init__(source)
 
+    def hg_version(self):
+        """ Returns the version of mercurial as a tuple of integers, or
+            ``None`` if it can't be determined.
+        """
+        return common.tool_cache.get(
+            ('version', self.hg_executable), self._hg_version)
+
+    def _hg_version(self):
+        returncode, stdout, stderr = common.runner.run(
+            [self.hg_executable, '--version', '--quiet'],
+            env=common.environment(unset=['PYTHONPATH']))
+        match = re.search(b(r'version (\d+)\.(\d+)'), stdout)
+        if returncode != 0 or match is None:
+            return None
+        return tuple(int(x) for x in match.groups())
+
+    def _remotenames(self):
+        """ Returns the options enabling the remotenames extension of
+            mercurial 4.5 or newer, or ``None`` for older versions.
+
+            It records the heads of the remote on clones, pulls and pushes,
+            which is needed to tell unpushed changesets apart from the ones
+            pulled from a non-publishing repository, as both are in the draft
+            phase.
+        """
+        version = self.hg_version()
+        if version is None or version < (4, 5):
+            return None
+        return ['--config', 'extensions.remotenames=']
+
     def hg_clone(self, **kwargs):
         name = self.source['name']
         path = self.source['path']
@@ -29,13 +62,17 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
             return
         rev = self.get_rev()
         self.output((logger.info, 'Cloned %r with mercurial.' % name))
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.hg_executable, 'clone', '--updaterev', rev, '--quiet', '--noninteractive', url, path],
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        args = [self.hg_executable, 'clone', '--updaterev', rev, '--quiet', '--noninteractive', url, path]
+        remotenames = self._remotenames()
+        if remotenames is not None:
+            # clones of local repositories only record the remote heads
+            # with --pull, which also gives up hardlinking them
+            args[2:2] = ['--pull']
+            args.extend(remotenames)
+        returncode, stdout, stderr = common.runner.run(
+            args, network=True, target=path,
+            env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             raise MercurialError(
                 'hg clone for %r failed.\n%s' % (name, stderr))
         if kwargs.get('verbose', False):
@@ -60,13 +97,10 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
     def _update_to_rev(self, rev):
         path = self.source['path']
         name = self.source['name']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
+        returncode, stdout, stderr = common.runner.run(
             [self.hg_executable, 'checkout', rev, '-c'],
-            cwd=path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode:
+            cwd=path, env=common.environment(unset=['PYTHONPATH']))
+        if returncode:
             raise MercurialError(
                 'hg update for %r failed.\n%s' % (name, stderr))
         self.output((logger.info, 'Switched %r to %s.' % (name, rev)))
@@ -75,16 +109,13 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
     def _get_tags(self):
         path = self.source['path']
         name = self.source['name']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
         try:
-            cmd = subprocess.Popen(
+            returncode, stdout, stderr = common.runner.run(
                 [self.hg_executable, 'tags'],
-                cwd=path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                cwd=path, env=common.environment(unset=['PYTHONPATH']))
         except OSError:
             return []
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode:
+        if returncode:
             raise MercurialError(
                 'hg update for %r failed.\n%s' % (name, stderr))
 
@@ -118,13 +149,10 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
         name = self.source['name']
         path = self.source['path']
         self.output((logger.info, 'Updated %r with mercurial.' % name))
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.hg_executable, 'pull', '-u'],
-            cwd=path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(
+            [self.hg_executable, 'pull', '-u'] + (self._remotenames() or []), cwd=path,
+            network=True, env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             # hg v2.1 pull returns non-zero return code in case of
             # no remote changes.
             if 'no changes found' not in stdout:
@@ -151,18 +179,16 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
                     'Source URL for existing package %r differs. '
                     'Expected %r.' % (name, self.source['url']))
         else:
+            self.work = 'checkout'
             return self.hg_clone(**kwargs)
 
     def matches(self):
         name = self.source['name']
         path = self.source['path']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
+        returncode, stdout, stderr = common.runner.run(
             [self.hg_executable, 'showconfig', 'paths.default'], cwd=path,
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+            env=common.environment(unset=['PYTHONPATH']))
+        if returncode != 0:
             raise MercurialError(
                 'hg showconfig for %r failed.\n%s' % (name, stderr))
         # now check that the working branch is the same
@@ -170,20 +196,44 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
 
     def status(self, **kwargs):
         path = self.source['path']
-        env = dict(os.environ)
-        env.pop('PYTHONPATH', None)
-        cmd = subprocess.Popen(
-            [self.hg_executable, 'status'], cwd=path,
-            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
+        env = common.environment(unset=['PYTHONPATH'])
+        args = [self.hg_executable, 'status']
+        if not self.source.get('untracked', True):
+            args.extend(['--modified', '--added', '--removed', '--deleted'])
+        if kwargs.get('verbose', False):
+            returncode, stdout, stderr = common.runner.run(args, cwd=path, env=env)
+        else:
+            # each line is a change, so the first one is enough
+            returncode, stdout, stderr = common.runner.run_until(
+                args, lambda line: True, cwd=path, env=env)
         status = stdout and 'dirty' or 'clean'
         if status == 'clean':
-            cmd = subprocess.Popen(
-                [self.hg_executable, 'outgoing'], cwd=path,
-                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            outgoing_stdout, stderr = cmd.communicate()
-            stdout += b('\n') + outgoing_stdout
-            if cmd.returncode == 0:
+            if kwargs.get('remote', False):
+                # exits with 0 if there are outgoing changes
+                returncode, ahead_stdout, stderr = common.runner.run(
+                    [self.hg_executable, 'outgoing'], cwd=path,
+                    network=True, env=env)
+                ahead = returncode == 0
+            else:
+                # changesets which weren't pushed to a publishing repository
+                # are still in the draft phase, that can be checked offline,
+                # the ones known to be on the remote are excluded
+                args = [
+                    self.hg_executable, 'log',
+                    '--template', '{rev}:{node|short} {desc|firstline}\n']
+                if not kwargs.get('verbose', False):
+                    args.extend(['--limit', '1'])
+                remotenames = self._remotenames()
+                if remotenames is None:
+                    args.extend(['--rev', 'draft()'])
+                else:
+                    args.extend(remotenames)
+                    args.extend(['--rev', 'draft() and not ::remotenames()'])
+                returncode, ahead_stdout, stderr = common.runner.run(
+                    args, cwd=path, env=env)
+                ahead = returncode == 0 and bool(ahead_stdout.strip())
+            stdout += b('\n') + ahead_stdout
+            if ahead:
                 status = 'ahead'
         if kwargs.get('verbose', False):
             return status, stdout
@@ -199,4 +249,5 @@ class MercurialWorkingCopy(common.BaseWorkingCopy):
         if self.status() != 'clean' and not kwargs.get('force', False):
             raise MercurialError(
                 "Can't update package %r because it's dirty." % name)
+        self.work = 'update'
         return self.hg_pull(**kwargs)
@@ -9,11 +9,14 @@ try:
     etree  # shutup pyflakes
 except ImportError:
     import elementtree.ElementTree as etree
+import collections
 import getpass
 import os
 import re
 import subprocess
 import sys
+import threading
+import time
 
 
 try:
@@ -44,14 +47,136 @@ class SVNCertificateRejectedError(SVNError):
 _svn_version_warning = False
 
 
+class PathCache(object):
+    """ A thread safe cache keyed by the path of a working copy. Entries
+        expire after ``ttl`` seconds and the least recently stored ones are
+        dropped beyond ``size`` entries. Subversion commands which change a
+        working copy ``invalidate`` its path.
+    """
+
+    def __init__(self, ttl=300, size=1000):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def get(self, path, default=None):
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.time():
+                del self._entries[key]
+                return default
+            return entry[1]
+
+    def set(self, path, value):
+        key = self._key(path)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, path, default=None):
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.time():
+            return default
+        return entry[1]
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(self._key(path), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _svn_info_entry(entry):
+    """ Returns a dictionary with the revision, url and repository root
+        of an ``entry`` element from the output of ``svn info --xml``.
+    """
+    result = {}
+    if entry is not None:
+        rev = entry.attrib.get('revision')
+        if rev is not None:
+            result['revision'] = rev
+        info_url = entry.find('url')
+        if info_url is not None:
+            result['url'] = info_url.text
+        root = entry.find('root')
+        if root is not None:
+            result['root'] = root.text
+    return result
+
+
+def _svn_entry_changed(entry):
+    """ Returns whether the ``entry`` element from the output of
+        ``svn status --xml`` is a change and not just an external.
+    """
+    status = entry.find('wc-status')
+    return status is not None and status.get('item') != 'external'
+
+
+def _svn_status_changes(stream):
+    """ Parses the output of ``svn status --xml`` while it's read from
+        ``stream`` and yields the target path of each changed entry. The
+        parsed entries are dropped right away, so the memory use doesn't
+        grow with the size of the output.
+    """
+    elements = []
+    target = None
+    for event, elem in etree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            elements.append(elem)
+            if elem.tag == 'target':
+                target = elem.get('path')
+            continue
+        elements.pop()
+        if elem.tag != 'entry':
+            continue
+        if _svn_entry_changed(elem):
+            yield target
+        if elements:
+            elements[-1].remove(elem)
+
+
+class _CountingReader(object):
+    """ Wraps the binary file ``stream`` and counts the bytes read from it
+        in ``size``.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        return data
+
+
 class SVNWorkingCopy(common.BaseWorkingCopy):
-    _svn_info_cache = {}
+    _fingerprint_files = ('.svn/wc.db',)
+    _svn_info_cache = PathCache()
+    # clean flags from ``prefetch``, each is used by one ``status`` call
+    _svn_status_cache = PathCache()
+    # the number of paths passed to one batched ``svn`` command
+    _prefetch_size = 100
     _svn_auth_cache = {}
     _svn_cert_cache = {}
 
     @classmethod
     def _clear_caches(klass):
         klass._svn_info_cache.clear()
+        klass._svn_status_cache.clear()
         klass._svn_auth_cache.clear()
         klass._svn_cert_cache.clear()
 
@@ -77,16 +202,21 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
 
     def _svn_check_version(self):
         global _svn_version_warning
+        version = common.tool_cache.get(
+            ('version', self.svn_executable), self._svn_version)
+        if (version < (1, 5)) and not _svn_version_warning:
+            logger.warning("The installed 'svn' command is too old. Expected 1.5 or newer, got %s." % ".".join([str(x) for x in version]))
+            _svn_version_warning = True
+
+    def _svn_version(self):
         try:
-            cmd = subprocess.Popen([self.svn_executable, "--version"],
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
+            returncode, stdout, stderr = common.runner.run(
+                [self.svn_executable, "--version"])
         except OSError:
             if getattr(sys.exc_info()[1], 'errno', None) == 2:
                 logger.error("Couldn't find 'svn' executable on your PATH.")
                 sys.exit(1)
             raise
-        stdout, stderr = cmd.communicate()
         lines = stdout.split(b('\n'))
         version = None
         if len(lines):
@@ -97,13 +227,11 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
                     version = (int(version[0]), int(version[1]), int(version[2][1:]))
                 else:
                     version = (int(version[0]), int(version[1]))
-        if (cmd.returncode != 0) or (version is None):
+        if (returncode != 0) or (version is None):
             logger.error("Couldn't determine the version of 'svn' command.")
             logger.error("Subversion output:\n%s\n%s" % (s(stdout), s(stderr)))
             sys.exit(1)
-        if (version < (1, 5)) and not _svn_version_warning:
-            logger.warning("The installed 'svn' command is too old. Expected 1.5 or newer, got %s." % ".".join([str(x) for x in version]))
-            _svn_version_warning = True
+        return version
 
     def _svn_auth_get(self, url):
         for root in self._svn_auth_cache:
@@ -181,6 +309,14 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
             return s(stdout)
 
     def _svn_communicate(self, args, url, **kwargs):
+        try:
+            return self._svn_run(args, url, **kwargs)
+        finally:
+            path = self.source['path']
+            self._svn_info_cache.invalidate(path)
+            self._svn_status_cache.invalidate(path)
+
+    def _svn_run(self, args, url, **kwargs):
         auth = self._svn_auth_get(url)
         if auth is not None:
             args[2:2] = ["--username", auth['user'],
@@ -198,53 +334,126 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
         args[2:2] = ["--no-auth-cache"]
         interactive_args = args[:]
         args[2:2] = ["--non-interactive"]
-        cmd = subprocess.Popen(args,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        returncode, stdout, stderr = common.runner.run(args, network=True)
+        if returncode != 0:
             lines = stderr.strip().split(b('\n'))
             if 'authorization failed' in lines[-1] or 'Could not authenticate to server' in lines[-1]:
                 raise SVNAuthorizationError(stderr.strip())
             if 'Server certificate verification failed: issuer is not trusted' in lines[-1]:
-                cmd = subprocess.Popen(interactive_args,
-                                       stdin=subprocess.PIPE,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE)
-                stdout, stderr = cmd.communicate('t')
+                returncode, stdout, stderr = common.runner.run(
+                    interactive_args, network=True,
+                    stdin=subprocess.PIPE, input=b('t'))
                 raise SVNCertificateError(stderr.strip())
-        return stdout, stderr, cmd.returncode
+        return stdout, stderr, returncode
 
     def _svn_info(self):
         name = self.source['name']
-        if name in self._svn_info_cache:
-            return self._svn_info_cache[name]
         path = self.source['path']
-        cmd = subprocess.Popen([self.svn_executable, "info", "--non-interactive", "--xml",
-                                path],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
+        result = self._svn_info_cache.get(path)
+        if result is not None:
+            return result
+        returncode, stdout, stderr = common.runner.run(
+            [self.svn_executable, "info", "--non-interactive", "--xml", path])
+        if returncode != 0:
             raise SVNError("Subversion info for '%s' failed.\n%s" % (name, s(stderr)))
-        info = etree.fromstring(stdout)
-        result = {}
-        entry = info.find('entry')
-        if entry is not None:
-            rev = entry.attrib.get('revision')
-            if rev is not None:
-                result['revision'] = rev
-            info_url = entry.find('url')
-            if info_url is not None:
-                result['url'] = info_url.text
-        entry = info.find('entry')
-        if entry is not None:
-            root = entry.find('root')
-            if root is not None:
-                result['root'] = root.text
-        self._svn_info_cache[name] = result
+        result = _svn_info_entry(etree.fromstring(stdout).find('entry'))
+        self._svn_info_cache.set(path, result)
         return result
 
+    @classmethod
+    def prefetch(klass, wcs, status=True):
+        """ Fills the info and status caches for all ``wcs`` with one
+            ``svn info`` and ``svn status`` call per ``_prefetch_size``
+            working copies, skipping the info of those which are still
+            cached. Anything which isn't answered here is left to the calls
+            for the single working copies, which report errors.
+        """
+        paths = {}
+        for wc in wcs:
+            path = os.path.normpath(wc.source['path'])
+            if os.path.isdir(os.path.join(path, '.svn')):
+                paths[path] = wc
+        if not paths:
+            return
+        svn_executable = wcs[0].svn_executable
+        todo = [x for x in sorted(paths) if klass._svn_info_cache.get(x) is None]
+        for i in range(0, len(todo), klass._prefetch_size):
+            chunk = todo[i:i + klass._prefetch_size]
+            info = klass._svn_prefetch_xml(
+                [svn_executable, "info", "--non-interactive", "--xml"] + chunk)
+            if info is None:
+                continue
+            for entry in info.findall('entry'):
+                path = os.path.normpath(entry.get('path', ''))
+                if path in paths:
+                    klass._svn_info_cache.set(path, _svn_info_entry(entry))
+        if not status:
+            return
+        todo = sorted(paths)
+        for i in range(0, len(todo), klass._prefetch_size):
+            chunk = todo[i:i + klass._prefetch_size]
+            returncode, changes, stderr = klass._svn_status_changes(
+                [svn_executable, "status", "--xml"] + chunk)
+            if returncode != 0 or changes is None:
+                continue
+            clean = dict((x, True) for x in chunk)
+            for path in changes:
+                # externals are reported as targets below the working copy
+                path = os.path.normpath(path or '')
+                while path not in paths and os.path.dirname(path) != path:
+                    path = os.path.dirname(path)
+                if path in paths:
+                    clean[path] = False
+            for path in chunk:
+                klass._svn_status_cache.set(path, clean[path])
+
+    @classmethod
+    def _svn_prefetch_xml(klass, args):
+        returncode, stdout, stderr = common.runner.run(args)
+        if returncode != 0:
+            return None
+        try:
+            return etree.fromstring(stdout)
+        except SyntaxError:
+            return None
+
+    @classmethod
+    def _svn_status_changes(klass, args, first=False):
+        """ Runs the ``svn status --xml`` command ``args`` and returns its
+            exit code, the set of target paths with changes and the error
+            output. The output is parsed while it arrives. With ``first``
+            the command is stopped at the first change and the exit code is
+            ``None``. The changes are ``None`` if the output is invalid.
+        """
+        cmd = common.runner.popen(
+            args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr = []
+        thread = threading.Thread(target=lambda: stderr.append(cmd.stderr.read()))
+        thread.daemon = True
+        thread.start()
+        changes = set()
+        stopped = False
+        stdout = _CountingReader(cmd.stdout)
+        try:
+            for path in _svn_status_changes(stdout):
+                changes.add(path)
+                if first:
+                    stopped = True
+                    try:
+                        cmd.kill()
+                    except OSError:
+                        pass
+                    break
+        except SyntaxError:
+            changes = None
+        finally:
+            cmd.stdout.close()
+            thread.join()
+            cmd.wait()
+            cmd.record(stdout.size + common.output_size(b('').join(stderr)))
+        returncode = None if stopped else cmd.returncode
+        return returncode, changes, b('').join(stderr)
+
     def _svn_switch(self, **kwargs):
         name = self.source['name']
         path = self.source['path']
@@ -278,16 +487,19 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
             self.output((logger.info, "Skipped checkout of existing package '%s'." % name))
             return
         self.output((logger.info, "Checked out '%s' with subversion." % name))
+        self.work = 'checkout'
         return self._svn_error_wrapper(self._svn_checkout, **kwargs)
 
     def svn_switch(self, **kwargs):
         name = self.source['name']
         self.output((logger.info, "Switched '%s' with subversion." % name))
+        self.work = 'update'
         return self._svn_error_wrapper(self._svn_switch, **kwargs)
 
     def svn_update(self, **kwargs):
         name = self.source['name']
         self.output((logger.info, "Updated '%s' with subversion." % name))
+        self.work = 'update'
         return self._svn_error_wrapper(self._svn_update, **kwargs)
 
     def checkout(self, **kwargs):
@@ -332,30 +544,21 @@ class SVNWorkingCopy(common.BaseWorkingCopy):
     def status(self, **kwargs):
         name = self.source['name']
         path = self.source['path']
-        cmd = subprocess.Popen([self.svn_executable, "status", "--xml", path],
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-        stdout, stderr = cmd.communicate()
-        if cmd.returncode != 0:
-            raise SVNError("Subversion status for '%s' failed.\n%s" % (name, s(stderr)))
-        info = etree.fromstring(stdout)
-        clean = True
-        for target in info.findall('target'):
-            for entry in target.findall('entry'):
-                status = entry.find('wc-status')
-                if status is not None and status.get('item') != 'external':
-                    clean = False
-                    break
+        clean = self._svn_status_cache.pop(path)
+        if clean is None:
+            returncode, changes, stderr = self._svn_status_changes(
+                [self.svn_executable, "status", "--xml", path], first=True)
+            if returncode not in (0, None) or changes is None:
+                raise SVNError("Subversion status for '%s' failed.\n%s" % (name, s(stderr)))
+            clean = not changes
         if clean:
             status = 'clean'
         else:
             status = 'dirty'
         if kwargs.get('verbose', False):
-            cmd = subprocess.Popen([self.svn_executable, "status", path],
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-            stdout, stderr = cmd.communicate()
-            if cmd.returncode != 0:
+            returncode, stdout, stderr = common.runner.run(
+                [self.svn_executable, "status", path])
+            if returncode != 0:
                 raise SVNError("Subversion status for '%s' failed.\n%s" % (name, s(stderr)))
             return status, s(stdout)
         else:
@@ -1,6 +1,8 @@
-from mr.developer.common import Config, Rewrite
+from mr.developer.common import BaseWorkingCopy, Config, Rewrite
 from mr.developer.common import get_commands, parse_buildout_args, version_sorted
+import os
 import pytest
+import sys
 
 
 def test_find_internal_commands():
@@ -51,6 +53,14 @@ def test_buildout_args_key_is_str(tempdir):
     assert type(read_config.get('buildout', 'args')) == str
 
 
+def test_timings_option(tempdir):
+    assert Config(tempdir).timings is False
+    tempdir['.mr.developer-options.cfg'].create_file(
+        "[mr.developer]",
+        "timings = true")
+    assert Config(tempdir).timings is True
+
+
 class TestRewrites:
     def testMissingSubstitute(self):
         pytest.raises(ValueError, Rewrite, ("url ~ foo"))
@@ -112,3 +122,816 @@ def test_version_sorted():
         'version-1-0-2',
         'version-1-0-1'])
     assert expected == actual
+
+
+class TestWorkingCopiesProbe:
+    @pytest.fixture
+    def workingcopies(self):
+        from mr.developer.common import BaseWorkingCopy, WCError, WorkingCopies
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            probed = []
+
+            def fingerprint(self):
+                return self.source.get('fingerprint')
+
+            def matches(self):
+                self.probed.append(self.source['name'])
+                return self.source['url'] == 'match'
+
+            def status(self, **kwargs):
+                if self.source.get('fail'):
+                    raise WCError("Status of '%s' failed." % self.source['name'])
+                status = 'ahead' if kwargs.get('remote', False) else 'clean'
+                if kwargs.get('verbose', False):
+                    return 'dirty', 'M foo'
+                return status
+
+        sources = dict(
+            (name, dict(name=name, kind='mock', url=url))
+            for name, url in (('foo', 'match'), ('bar', 'other'), ('ham', 'match')))
+        workingcopies = WorkingCopies(sources, threads=2)
+        workingcopies.workingcopytypes = dict(mock=MockWorkingCopy)
+        return workingcopies
+
+    def testProbe(self, workingcopies):
+        results = workingcopies.probe(['foo', 'bar', 'ham'])
+        assert results == dict(
+            foo=(True, 'clean', None),
+            bar=(False, 'clean', None),
+            ham=(True, 'clean', None))
+
+    def testProbeVerbose(self, workingcopies):
+        results = workingcopies.probe(['foo'], verbose=True)
+        assert results == dict(foo=(True, 'dirty', 'M foo'))
+
+    def testProbeWithoutStatus(self, workingcopies):
+        results = workingcopies.probe(['foo', 'bar'], status=False)
+        assert results == dict(
+            foo=(True, None, None),
+            bar=(False, None, None))
+
+    def testProbeError(self, workingcopies):
+        workingcopies.sources['bar']['fail'] = True
+        pytest.raises(SystemExit, workingcopies.probe, ['foo', 'bar', 'ham'])
+
+    def testProbeWithCache(self, workingcopies, tempdir):
+        from mr.developer.common import StatusCache
+        sources = workingcopies.sources
+        probed = workingcopies.workingcopytypes['mock'].probed
+        sources['foo']['fingerprint'] = 'index:1:2'
+        sources['bar']['fingerprint'] = 'index:1:2'
+        cache = StatusCache(tempdir['status.cfg'])
+        results = workingcopies.probe(['foo', 'bar', 'ham'], cache=cache)
+        assert sorted(probed) == ['bar', 'foo', 'ham']
+        cache.save()
+        del probed[:]
+        cache = StatusCache(tempdir['status.cfg'])
+        assert workingcopies.probe(['foo', 'bar', 'ham'], cache=cache) == results
+        # only the package without fingerprint was probed
+        assert probed == ['ham']
+        del probed[:]
+        # a changed fingerprint or url invalidates the entry
+        sources['foo']['fingerprint'] = 'index:2:2'
+        sources['bar']['url'] = 'match'
+        results = workingcopies.probe(['foo', 'bar'], cache=cache)
+        assert sorted(probed) == ['bar', 'foo']
+        assert results['bar'] == (True, 'clean', None)
+        del probed[:]
+        # verbose probes always run
+        workingcopies.probe(['foo'], verbose=True, cache=cache)
+        assert probed == ['foo']
+        del probed[:]
+        # as do remote ones
+        results = workingcopies.probe(['foo'], remote=True, cache=cache)
+        assert probed == ['foo']
+        assert results == dict(foo=(True, 'ahead', None))
+
+
+class TestFingerprint:
+    def testWorktreeChanges(self, tempdir):
+        import time
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            _fingerprint_files = ('.vcs/index',)
+
+        path = tempdir['egg']
+        os.makedirs(os.path.join(path, '.vcs'))
+        path['.vcs']['index'].create_file('index')
+        path['foo'].create_file('foo')
+        wc = MockWorkingCopy(dict(name='egg', path=path))
+        fingerprint = wc.fingerprint()
+        assert fingerprint is not None
+        assert wc.fingerprint() == fingerprint
+        # a tracked top level file is modified without touching the index
+        mtime = os.stat(path['foo']).st_mtime + 10
+        os.utime(path['foo'], (mtime, mtime))
+        assert wc.fingerprint() != fingerprint
+        fingerprint = wc.fingerprint()
+        path['bar'].create_file('bar')
+        assert wc.fingerprint() != fingerprint
+        fingerprint = wc.fingerprint()
+        # the metadata directory itself isn't part of the worktree
+        time.sleep(0.01)
+        path['.vcs']['lock'].create_file('lock')
+        os.remove(path['.vcs']['lock'])
+        assert wc.fingerprint().split()[-1] == fingerprint.split()[-1]
+
+
+class TestStatusCache:
+    def testRoundTrip(self, tempdir):
+        from mr.developer.common import StatusCache
+        source = dict(name='foo', kind='git', url='https://example.com/foo.git')
+        cache = StatusCache(tempdir['status.cfg'])
+        assert cache.get(source, 'fp') is None
+        cache.set(source, 'fp', True, 'ahead')
+        cache.save()
+        cache = StatusCache(tempdir['status.cfg'])
+        assert cache.get(source, 'fp') == (True, 'ahead')
+        assert cache.get(source, 'other') is None
+        assert cache.get(dict(source, kind='svn'), 'fp') is None
+        # other options like a pinned revision affect whether it matches
+        assert cache.get(dict(source, rev='1.0'), 'fp') is None
+        assert cache.get(dict(source, path='src/foo'), 'fp') == (True, 'ahead')
+        # setting only the match result keeps the status
+        cache.set(source, 'fp', True)
+        assert cache.get(source, 'fp') == (True, 'ahead')
+        cache.set(source, 'fp', False)
+        assert cache.get(source, 'fp') == (False, None)
+
+    def testInvalidate(self, tempdir):
+        from mr.developer.common import StatusCache
+        import os
+        cache = StatusCache(tempdir['status.cfg'])
+        for name in ('foo', 'bar'):
+            cache.set(dict(name=name, kind='git', url=name), 'fp', True, 'clean')
+        cache.save()
+        cache.invalidate(['foo'])
+        cache.save()
+        cache = StatusCache(tempdir['status.cfg'])
+        assert cache.get(dict(name='foo', kind='git', url='foo'), 'fp') is None
+        assert cache.get(dict(name='bar', kind='git', url='bar'), 'fp') == (True, 'clean')
+        cache.invalidate()
+        cache.save()
+        assert not os.path.exists(tempdir['status.cfg'])
+
+
+class TestToolCache:
+    @pytest.fixture(autouse=True)
+    def clear_tool_cache(self):
+        from mr.developer.common import tool_cache
+        tool_cache.clear()
+        yield
+        tool_cache.clear()
+
+    def testGet(self):
+        from mr.developer.common import ToolCache
+        cache = ToolCache()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return (2, 39)
+
+        assert cache.get(('version', 'git'), factory) == (2, 39)
+        assert cache.get(('version', 'git'), factory) == (2, 39)
+        assert len(calls) == 1
+        cache.clear()
+        assert cache.get(('version', 'git'), factory) == (2, 39)
+        assert len(calls) == 2
+
+    def testWhichIsCached(self, monkeypatch, tempdir):
+        from mr.developer.common import which
+        import os
+        import stat
+        os.mkdir(tempdir['bin'])
+        exe = tempdir['bin']['mrdevtool']
+        exe.create_file('#!/bin/sh')
+        os.chmod(exe, stat.S_IRWXU)
+        monkeypatch.setenv('PATH', tempdir['bin'])
+        assert which('mrdevtool') == exe
+        os.remove(exe)
+        assert which('mrdevtool') == exe
+        # a changed PATH results in a new lookup
+        monkeypatch.setenv('PATH', tempdir['bin'] + os.pathsep)
+        assert which('mrdevtool', default='missing') == 'missing'
+
+    def testEnvironment(self, monkeypatch):
+        from mr.developer.common import environment
+        monkeypatch.setenv('PYTHONPATH', 'foo')
+        env = environment(unset=['PYTHONPATH'], GIT_OPTIONAL_LOCKS='0')
+        assert 'PYTHONPATH' not in env
+        assert env['GIT_OPTIONAL_LOCKS'] == '0'
+        assert environment(unset=['PYTHONPATH'], GIT_OPTIONAL_LOCKS='0') is env
+        assert 'GIT_OPTIONAL_LOCKS' not in environment(unset=['PYTHONPATH'])
+
+
+class TestWorkingCopiesProcess:
+    @pytest.fixture
+    def workingcopies(self):
+        from mr.developer.common import BaseWorkingCopy, WCError, WorkingCopies
+        import time
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            done = []
+
+            def checkout(self, **kwargs):
+                if self.source.get('fail'):
+                    raise WCError("Checkout of '%s' failed." % self.source['name'])
+                time.sleep(0.05)
+                self.done.append(self.source['name'])
+
+        workingcopies = WorkingCopies({}, threads=2)
+        workingcopies.workingcopytypes = dict(mock=MockWorkingCopy)
+        return workingcopies
+
+    def jobs(self, workingcopies, names, fail=()):
+        wc_class = workingcopies.workingcopytypes['mock']
+        for name in names:
+            wc = wc_class(dict(name=name, kind='mock', fail=name in fail))
+            yield wc, wc.checkout, {}
+
+    def testProcess(self, workingcopies):
+        names = ['pkg%02i' % i for i in range(6)]
+        workingcopies.process(self.jobs(workingcopies, names))
+        assert sorted(workingcopies.workingcopytypes['mock'].done) == names
+
+    def testProcessStopsOnError(self, workingcopies):
+        from mock import patch
+        from mr.developer.common import Progress
+        import threading
+        started = threading.Event()
+        failed = threading.Event()
+
+        class FailureProgress(Progress):
+            # called by the scheduler when it sees the failure, right
+            # before it stops starting jobs
+            def finish(self, wc, success):
+                super(FailureProgress, self).finish(wc, success)
+                if not success:
+                    failed.set()
+
+        wc_class = workingcopies.workingcopytypes['mock']
+        checkout = wc_class.checkout
+
+        def blocked_checkout(self, **kwargs):
+            # the failing job waits for the second one to start, which
+            # waits until the failure is seen
+            if self.source.get('fail'):
+                assert started.wait(5)
+            else:
+                started.set()
+                assert failed.wait(5)
+            checkout(self, **kwargs)
+
+        def jobs():
+            names = ['pkg%02i' % i for i in range(10)]
+            for i, job in enumerate(self.jobs(workingcopies, names, fail=['pkg00'])):
+                if i == 2:
+                    assert failed.wait(5)
+                yield job
+
+        wc_class.checkout = blocked_checkout
+        workingcopies.progress = True
+        with patch('mr.developer.common.Progress', FailureProgress):
+            pytest.raises(SystemExit, workingcopies.process, jobs())
+        # the job running next to the failed one is finished, no other starts
+        assert wc_class.done == ['pkg01']
+
+    def testProcessContinueOnError(self, workingcopies):
+        workingcopies.continue_on_error = True
+        names = ['pkg%02i' % i for i in range(10)]
+        pytest.raises(
+            SystemExit,
+            workingcopies.process,
+            self.jobs(workingcopies, names, fail=['pkg00']))
+        assert sorted(workingcopies.workingcopytypes['mock'].done) == names[1:]
+
+    def testProcessHostThreads(self):
+        from mr.developer.common import BaseWorkingCopy, WorkingCopies
+        import threading
+        import time
+        lock = threading.Lock()
+        running = {}
+        maximum = {}
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            def checkout(self, **kwargs):
+                host = self.source['host']
+                with lock:
+                    running[host] = running.get(host, 0) + 1
+                    maximum[host] = max(maximum.get(host, 0), running[host])
+                time.sleep(0.02)
+                with lock:
+                    running[host] -= 1
+
+        def jobs():
+            for i in range(12):
+                host = 'git.example.com' if i < 8 else 'github.com'
+                wc = MockWorkingCopy(dict(
+                    name='pkg%02i' % i, host=host,
+                    url='git@%s:pkg%02i.git' % (host, i)))
+                yield wc, wc.checkout, {}
+
+        workingcopies = WorkingCopies(
+            {}, threads=4, host_threads={'git.example.com': 2})
+        workingcopies.process(jobs())
+        assert maximum['git.example.com'] == 2
+        assert maximum['github.com'] > 1
+
+    def testUpdateStatusChecksShareThreads(self):
+        from mr.developer.common import BaseWorkingCopy, WorkingCopies
+        import threading
+        import time
+        lock = threading.Lock()
+        state = dict(running=0, maximum=0)
+        updated = []
+
+        def run():
+            with lock:
+                state['running'] += 1
+                state['maximum'] = max(state['maximum'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            def status(self, **kwargs):
+                run()
+                return 'clean'
+
+            def update(self, **kwargs):
+                run()
+                updated.append(self.source['name'])
+
+        names = ['pkg%02i' % i for i in range(8)]
+        sources = dict(
+            (name, dict(name=name, kind='mock', path=name)) for name in names)
+        workingcopies = WorkingCopies(sources, threads=2)
+        workingcopies.workingcopytypes = dict(mock=MockWorkingCopy)
+        workingcopies.update(names)
+        assert sorted(updated) == names
+        assert state['maximum'] == 2
+
+    def testProcessProgress(self, workingcopies, caplog):
+        import logging
+        caplog.set_level(logging.INFO)
+        workingcopies.progress = True
+        workingcopies.continue_on_error = True
+        names = ['pkg%02i' % i for i in range(6)]
+        pytest.raises(
+            SystemExit,
+            workingcopies.process,
+            self.jobs(workingcopies, names, fail=['pkg03']))
+        assert "Processed 6 packages" in caplog.text
+        assert "1 failed." in caplog.text
+
+    def testProcessProgressWithoutThreads(self):
+        from mock import patch
+        from mr.developer.common import BaseWorkingCopy, Progress, WorkingCopies
+        import time
+        shown = []
+
+        class RecordingProgress(Progress):
+            interval = 0.01
+
+            def show(self):
+                shown.append(sorted(self.running))
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            def checkout(self, **kwargs):
+                time.sleep(0.1)
+
+        wc = MockWorkingCopy(dict(name='pkg00'))
+        workingcopies = WorkingCopies({}, threads=1, progress=True)
+        with patch('mr.developer.common.Progress', RecordingProgress):
+            workingcopies.process([(wc, wc.checkout, {})])
+        # the progress is redrawn while the job is running
+        assert shown.count(['pkg00']) > 2
+
+
+class TestProgress:
+    def testStatusLine(self):
+        from mr.developer.common import BaseWorkingCopy, Progress
+
+        class Terminal(object):
+            def __init__(self):
+                self.written = []
+
+            def isatty(self):
+                return True
+
+            def write(self, data):
+                self.written.append(data)
+
+            def flush(self):
+                pass
+
+        terminal = Terminal()
+        progress = Progress(stream=terminal)
+        wcs = [BaseWorkingCopy(dict(name=name)) for name in ('foo', 'bar')]
+        for wc in wcs:
+            progress.queue()
+        progress.start(wcs[0])
+        wcs[0].stream.write("Receiving objects:  45% (45/100)\r")
+        assert list(wcs[0].stream.lines) == []
+        progress.show()
+        assert terminal.written[-1].endswith(
+            "0 done, 0 failed, 1 running, 1 queued: foo 0s (Receiving objects 45%)")
+        progress.finish(wcs[0], False)
+        progress.clear()
+        assert terminal.written[-1] == "\r\x1b[K"
+        assert progress.summary() == "0 done, 1 failed, 0 running, 1 queued"
+
+
+@pytest.mark.parametrize('url, host', [
+    ('https://User@Git.Example.com:8443/repo.git', 'git.example.com'),
+    ('git@github.com:fschulze/mr.developer.git', 'github.com'),
+    ('svn+ssh://svn.example.com/repo/trunk', 'svn.example.com'),
+    ('file:///tmp/repo', None),
+    ('/tmp/repo', None),
+    ('C:\\repos\\foo', None),
+    ('', None)])
+def test_url_host(url, host):
+    from mr.developer.common import url_host
+    assert url_host(url) == host
+
+
+class TestWorkingCopiesUpdate:
+    @pytest.fixture
+    def workingcopies(self):
+        from mr.developer.common import BaseWorkingCopy, WorkingCopies
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            updated = []
+            jobs = []
+
+            def status(self, **kwargs):
+                return 'dirty' if self.source.get('dirty') else 'clean'
+
+            def checkout(self, **kwargs):
+                if kwargs.get('update'):
+                    return self.update(**kwargs)
+
+            def update(self, **kwargs):
+                self.work = 'update'
+                self.updated.append((self.source['name'], kwargs.get('force', False)))
+                self.jobs.append(kwargs['jobs'])
+
+        sources = {}
+        for i in range(6):
+            name = 'pkg%02i' % i
+            sources[name] = dict(name=name, kind='mock', dirty=i in (1, 4))
+        workingcopies = WorkingCopies(sources, threads=3)
+        workingcopies.workingcopytypes = dict(mock=MockWorkingCopy)
+        return workingcopies
+
+    def testOnlyDirtyPackagesArePrompted(self, workingcopies):
+        from mock import patch
+        with patch('mr.developer.common.yesno') as yesno:
+            yesno.side_effect = [True, False]
+            workingcopies.update(sorted(workingcopies.sources))
+        assert yesno.call_count == 2
+        updated = workingcopies.workingcopytypes['mock'].updated
+        assert sorted(updated) == [
+            ('pkg00', False), ('pkg01', True), ('pkg02', False),
+            ('pkg03', False), ('pkg05', False)]
+
+    def testAllAnswerForcesRemainingDirtyPackages(self, workingcopies):
+        from mock import patch
+        with patch('mr.developer.common.yesno') as yesno:
+            yesno.return_value = 'all'
+            workingcopies.update(sorted(workingcopies.sources))
+        assert yesno.call_count == 1
+        updated = workingcopies.workingcopytypes['mock'].updated
+        assert len(updated) == 6
+        assert ('pkg04', True) in updated
+
+    def testSubmoduleJobs(self, workingcopies):
+        workingcopies.update(['pkg00', 'pkg02', 'pkg03'])
+        assert workingcopies.workingcopytypes['mock'].jobs == [1, 1, 1]
+        workingcopies.update(['pkg05'])
+        assert workingcopies.workingcopytypes['mock'].jobs[-1] == 3
+
+    def testSlowestPackagesFirst(self, workingcopies, tempdir):
+        from mr.developer.common import Timings
+        timings = Timings(tempdir['timings.cfg'])
+        timings.set('update', 'pkg00', 1.0)
+        timings.set('update', 'pkg02', 5.0)
+        timings.set('update', 'pkg03', 2.0)
+        timings.set('update', 'pkg05', 0.5)
+        workingcopies.threads = 1
+        workingcopies.timings = timings
+        workingcopies.update(['pkg00', 'pkg02', 'pkg03', 'pkg05'])
+        updated = workingcopies.workingcopytypes['mock'].updated
+        assert [x[0] for x in updated] == ['pkg02', 'pkg03', 'pkg00', 'pkg05']
+        # the new durations are recorded and saved
+        timings = Timings(tempdir['timings.cfg'])
+        assert timings.get('update', 'pkg02') < 5.0
+        assert timings.get('update', 'pkg01') is None
+
+    def testOnlyWorkDoneIsTimed(self, workingcopies, tempdir):
+        from mr.developer.common import Timings
+        workingcopies.timings = Timings(tempdir['timings.cfg'])
+        wc = workingcopies.workingcopytypes['mock'](workingcopies.sources['pkg00'])
+        # a skipped checkout isn't recorded
+        assert workingcopies._run_job(wc, wc.checkout, dict(jobs=1))[0]
+        assert workingcopies.timings.get('checkout', 'pkg00') is None
+        # an always-checkout update is recorded as update
+        assert workingcopies._run_job(wc, wc.checkout, dict(jobs=1, update=True))[0]
+        assert workingcopies.timings.get('checkout', 'pkg00') is None
+        assert workingcopies.timings.get('update', 'pkg00') is not None
+
+
+class TestTimings:
+    def testRoundTrip(self, tempdir):
+        from mr.developer.common import Timings
+        timings = Timings(tempdir['timings.cfg'])
+        assert timings.get('checkout', 'foo') is None
+        timings.set('checkout', 'foo', 4.0)
+        timings.set('checkout', 'foo', 2.0)
+        timings.set('update', 'foo', 1.0)
+        timings.save()
+        timings = Timings(tempdir['timings.cfg'])
+        assert timings.get('checkout', 'foo') == 3.0
+        assert timings.get('update', 'foo') == 1.0
+        assert timings.get('update', 'bar') is None
+
+
+class TestStreamProcess:
+    def testOutputIsPrefixedAndKept(self, capsys):
+        from mr.developer.common import OutputChannel, stream_process
+        import subprocess
+        import sys
+        script = (
+            "import sys\n"
+            "sys.stdout.write('out1\\n\\nout2\\n')\n"
+            "sys.stderr.write('err1\\n')\n")
+        cmd = subprocess.Popen(
+            [sys.executable, '-c', script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        channel = OutputChannel('egg', echo=True, size=2)
+        stderr = stream_process(cmd, channel)
+        assert cmd.returncode == 0
+        assert stderr == 'err1\n'
+        captured = capsys.readouterr()
+        assert sorted(captured.out.splitlines()) == [
+            'egg: err1', 'egg: out1', 'egg: out2']
+        assert len(channel.lines) == 2
+
+
+class TestReportAction:
+    def testErrorOutputIsShownOnce(self, caplog):
+        from mr.developer.common import BaseWorkingCopy, WCError, report_action
+        import logging
+        caplog.set_level(logging.INFO)
+        wc = BaseWorkingCopy(dict(name='egg'))
+        wc.stream.write('Cloning into egg\nfatal: repository not found\n')
+        error = WCError("git clone of 'egg' failed.\nfatal: repository not found")
+        report_action(wc, {}, False, error)
+        assert [x.getMessage() for x in caplog.records] == [
+            "Last output of 'egg':",
+            "    Cloning into egg",
+            "git clone of 'egg' failed.",
+            "fatal: repository not found"]
+        caplog.clear()
+        wc.stream.lines.clear()
+        wc.stream.write('fatal: repository not found\n')
+        report_action(wc, {}, False, error)
+        assert [x.getMessage() for x in caplog.records] == [
+            "git clone of 'egg' failed.",
+            "fatal: repository not found"]
+
+
+class TestReadUntil:
+    def testStopsCommand(self):
+        from mr.developer.common import runner
+        import sys
+        script = (
+            "import sys\n"
+            "sys.stderr.write('err\\n')\n"
+            "sys.stdout.write('# header\\n')\n"
+            "while True:\n"
+            "    sys.stdout.write('change\\n')\n"
+            "    sys.stdout.flush()\n")
+        returncode, stdout, stderr = runner.run_until(
+            [sys.executable, '-c', script],
+            lambda line: not line.startswith(b'#'))
+        assert returncode is None
+        assert stdout == b'# header\nchange\n'
+        assert stderr == b'err\n'
+
+    def testReadsToEnd(self):
+        from mr.developer.common import runner
+        import sys
+        returncode, stdout, stderr = runner.run_until(
+            [sys.executable, '-c', "print('# header')"],
+            lambda line: not line.startswith('#'),
+            universal_newlines=True)
+        assert returncode == 0
+        assert stdout == '# header\n'
+        assert stderr == ''
+
+
+class SettingsWorkingCopy(BaseWorkingCopy):
+    """ Logs the runner settings of the process its checkout runs in. It's
+        defined at module level, so worker processes can import it.
+    """
+
+    def checkout(self, **kwargs):
+        from mr.developer.common import Popen, logger, runner
+        Popen([sys.executable, '-c', 'pass']).communicate()
+        self.output((logger.info, "timeout=%s retries=%s pid=%s" % (
+            runner.timeout, runner.retries, os.getpid())))
+
+
+class PromptingWorkingCopy(BaseWorkingCopy):
+    """ Asks for a password in its checkout, like subversion working copies
+        do when the server requires one.
+    """
+
+    def checkout(self, **kwargs):
+        from mr.developer.common import raw_input
+        return raw_input("Password: ")
+
+
+class TestProcessWorkingCopies:
+    def testSettingsReachWorkers(self, caplog, tempdir):
+        from mr.developer.common import ProcessWorkingCopies, profiler, runner
+        import logging
+        caplog.set_level(logging.INFO)
+        settings = runner.timeout, runner.retries
+        runner.timeout, runner.retries = 7, 2
+        profiler.enable(tempdir['profile.jsonl'])
+        try:
+            wc = SettingsWorkingCopy(dict(name='foo'))
+            ProcessWorkingCopies({}, threads=1).process([(wc, wc.checkout, {})])
+            spans = profiler.take()
+        finally:
+            runner.timeout, runner.retries = settings
+            profiler.enable(None)
+        assert "timeout=7 retries=2 pid=" in caplog.text
+        assert "pid=%s" % os.getpid() not in caplog.text
+        # the spans recorded in the worker are sent back
+        assert sorted(x['name'] for x in spans) == ['checkout', 'command']
+        assert set(x['package'] for x in spans) == set(['foo'])
+
+    def testPromptsFail(self, caplog):
+        from mr.developer.common import ProcessWorkingCopies
+        wc = PromptingWorkingCopy(dict(name='foo'))
+        with pytest.raises(SystemExit):
+            ProcessWorkingCopies({}, threads=1).process([(wc, wc.checkout, {})])
+        assert "Can't ask for credentials or other input for 'foo'" in caplog.text
+
+
+class TestProfiler:
+    @pytest.fixture
+    def profiler(self):
+        from mr.developer.common import profiler
+        yield profiler
+        profiler.enable(None)
+
+    def run_checkout(self):
+        from mr.developer.common import BaseWorkingCopy, Popen, WorkingCopies
+        import subprocess
+        import sys
+
+        class MockWorkingCopy(BaseWorkingCopy):
+            def checkout(self, **kwargs):
+                cmd = Popen(
+                    [sys.executable, '-c', 'print(42)'],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                cmd.communicate()
+
+        wc = MockWorkingCopy(dict(name='foo'))
+        WorkingCopies({}, threads=1).process([(wc, wc.checkout, {})])
+
+    def testJSONLines(self, profiler, tempdir):
+        import json
+        path = tempdir['profile.jsonl']
+        profiler.enable(path)
+        self.run_checkout()
+        profiler.save()
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        assert [x['name'] for x in spans] == ['command', 'checkout']
+        command, action = spans
+        assert command['package'] == action['package'] == 'foo'
+        assert command['args']['returncode'] == 0
+        assert command['args']['output'] in (3, 4)
+        assert action['args']['error'] is False
+        assert action['duration'] >= command['duration']
+
+    def testChromeTrace(self, profiler, tempdir):
+        import json
+        path = tempdir['profile.json']
+        profiler.enable(path)
+        self.run_checkout()
+        profiler.save()
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert [x['ph'] for x in events] == ['X', 'X']
+        assert events[1]['cat'] == 'action'
+        assert events[1]['args']['package'] == 'foo'
+
+    def testDisabled(self, profiler):
+        self.run_checkout()
+        assert profiler._spans == []
+
+
+class TestCommandRunner:
+    def command(self, code):
+        import sys
+        return [sys.executable, '-c', code]
+
+    @pytest.mark.skipif("os.name != 'posix'")
+    def testTimeoutKillsProcessGroup(self):
+        from mr.developer.common import CommandRunner, CommandTimeoutError
+        import time
+        runner = CommandRunner(timeout=0.5)
+        # the child keeps the output pipe open, so this only returns early
+        # if it's killed as well
+        command = self.command(
+            "import subprocess, sys; "
+            "subprocess.call([sys.executable, '-c', 'import time; time.sleep(30)'])")
+        start = time.time()
+        pytest.raises(CommandTimeoutError, runner.run, command, network=True)
+        assert time.time() - start < 10
+
+    def testNoTimeoutForLocalCommands(self):
+        from mr.developer.common import CommandRunner
+        runner = CommandRunner(timeout=0.01)
+        command = self.command("import time; time.sleep(0.2); print('done')")
+        returncode, stdout, stderr = runner.run(command)
+        assert returncode == 0
+        assert stdout.strip() == b'done'
+
+    def testRetryTransientErrors(self, tempdir):
+        from mr.developer.common import CommandRunner
+        counter = tempdir['counter']
+        command = self.command(
+            "import os, sys\n"
+            "exists = os.path.exists(%r)\n"
+            "open(%r, 'a').write('x')\n"
+            "if not exists:\n"
+            "    sys.stderr.write('fatal: unable to access: Could not resolve host: example.com')\n"
+            "    sys.exit(128)\n" % (counter, counter))
+        runner = CommandRunner(retries=2, backoff=0)
+        returncode, stdout, stderr = runner.run(command, network=True)
+        assert returncode == 0
+        with open(counter) as f:
+            assert f.read() == 'xx'
+
+    def testNoRetryForOtherErrors(self, tempdir):
+        from mr.developer.common import CommandRunner
+        counter = tempdir['counter']
+        command = self.command(
+            "import sys\n"
+            "open(%r, 'a').write('x')\n"
+            "sys.stderr.write('fatal: repository not found')\n"
+            "sys.exit(128)\n" % counter)
+        runner = CommandRunner(retries=2, backoff=0)
+        returncode, stdout, stderr = runner.run(command, network=True)
+        assert returncode == 128
+        with open(counter) as f:
+            assert f.read() == 'x'
+
+    def clone_command(self, counter, target):
+        # the first attempt leaves a partial clone behind and hangs, later
+        # ones fail like git if the target exists
+        return self.command(
+            "import os, sys, time\n"
+            "first = not os.path.exists(%r)\n"
+            "open(%r, 'a').write('x')\n"
+            "if os.path.exists(%r):\n"
+            "    sys.stderr.write('fatal: destination path already exists')\n"
+            "    sys.exit(128)\n"
+            "os.mkdir(%r)\n"
+            "if first:\n"
+            "    open(os.path.join(%r, 'partial'), 'w').close()\n"
+            "    time.sleep(30)\n" % (counter, counter, target, target, target))
+
+    @pytest.mark.skipif("os.name != 'posix'")
+    def testRetryTimedOutClone(self, tempdir):
+        from mr.developer.common import CommandRunner
+        counter = tempdir['counter']
+        target = tempdir['clone']
+        runner = CommandRunner(timeout=1, retries=1, backoff=0)
+        returncode, stdout, stderr = runner.run(
+            self.clone_command(counter, target), network=True, target=target)
+        assert returncode == 0
+        assert os.listdir(target) == []
+        with open(counter) as f:
+            assert f.read() == 'xx'
+
+    @pytest.mark.skipif("os.name != 'posix'")
+    def testTimedOutCloneIsRemoved(self, tempdir):
+        from mr.developer.common import CommandRunner, CommandTimeoutError
+        target = tempdir['clone']
+        runner = CommandRunner(timeout=1)
+        pytest.raises(
+            CommandTimeoutError, runner.run,
+            self.clone_command(tempdir['counter'], target),
+            network=True, target=target)
+        assert not os.path.exists(target)
@@ -228,6 +228,18 @@ class TestExtensionClass:
         })
         pytest.raises(ValueError, extension.get_sources)
 
+    def testUntrackedOptionParsing(self, buildout, extension):
+        buildout['sources'].update({
+            'pkg.foo': 'git dummy://foo/trunk untracked=false',
+        })
+        assert extension.get_sources()['pkg.foo']['untracked'] is False
+
+    def testInvalidUntrackedOption(self, buildout, extension):
+        buildout['sources'].update({
+            'pkg.foo': 'git dummy://foo/trunk untracked=maybe',
+        })
+        pytest.raises(ValueError, extension.get_sources)
+
     def testInvalidOptionParsing(self, buildout, extension):
         buildout['sources'].update({
             'pkg.foo': 'git dummy://foo/trunk rev=456ad138 =foo',
@@ -303,6 +315,19 @@ class TestExtensionClass:
         del buildout['sources']
         assert extension.get_sources() == {}
 
+    def testCommandOptions(self, buildout, extension):
+        assert extension.get_command_timeout() is None
+        assert extension.get_command_retries() == 0
+        buildout['buildout']['mr.developer-timeout'] = '30'
+        buildout['buildout']['mr.developer-retries'] = '2'
+        extension = type(extension)(buildout)
+        assert extension.get_command_timeout() == 30.0
+        assert extension.get_command_retries() == 2
+
+    def testInvalidCommandTimeout(self, buildout, extension):
+        buildout['buildout']['mr.developer-timeout'] = 'never'
+        pytest.raises(SystemExit, extension.get_command_timeout)
+
 
 class TestExtension:
     def testConfigCreated(self, tempdir):
@@ -4,8 +4,9 @@ import shutil
 import pytest
 from mock import patch
 
+from mr.developer.compat import s
 from mr.developer.extension import Source
-from mr.developer.tests.utils import Process
+from mr.developer.tests.utils import Process, record_git_commands
 
 
 class TestGit:
@@ -18,7 +19,7 @@ class TestGit:
         repository.add_file('foo2')
         # get comitted rev
         lines = repository("git log", echo=False)
-        rev = lines[0].split()[1]
+        rev = s(lines[0].split()[1])
         # return to default branch
         repository("git checkout master", echo=False)
         repository.add_file('bar')
@@ -253,3 +254,331 @@ class TestGit:
 
         # Check that the expected files from the branch are there
         assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'foo2'))
+
+    @pytest.mark.parametrize("git_version", [None, (2, 10)])
+    def testStatusProbe(self, develop, mkgitrepo, src, git_version):
+        from mr.developer.commands import CmdCheckout
+        from mr.developer.git import GitWorkingCopy
+        repository = mkgitrepo('repository')
+        repository.add_file('foo')
+        source = Source(
+            kind='git',
+            name='egg',
+            url=repository.url,
+            path=src['egg'])
+        develop.sources = {'egg': source}
+        CmdCheckout(develop)(develop.parser.parse_args(['co', 'egg']))
+
+        def make_wc(url=repository.url, **kwargs):
+            wc = GitWorkingCopy(Source(source, url=url, **kwargs))
+            if git_version is not None:
+                wc.git_version = lambda: git_version
+            return wc
+
+        wc = make_wc()
+        assert wc.matches()
+        assert wc.status() == 'clean'
+        probe = wc.git_probe()
+        assert probe['branch'] == 'master'
+        assert (probe['ahead'], probe['behind']) == (0, 0)
+        assert not make_wc(url='file:///other').matches()
+
+        egg = Process(cwd=src['egg'])
+        egg.check_call('git config user.email "florian.schulze@gmx.net"')
+        egg.check_call('git config user.name "Florian Schulze"')
+        src['egg']['bar'].create_file('bar')
+        egg.check_call("git add bar", echo=False)
+        egg.check_call("git commit -m bar", echo=False)
+        # the result is cached on the working copy
+        assert wc.status() == 'clean'
+        wc = make_wc()
+        assert wc.status() == 'ahead'
+        assert wc.git_probe()['ahead'] == 1
+        status, output = wc.status(verbose=True)
+        assert status == 'ahead'
+        assert output.startswith("## master...origin/master [ahead 1]")
+
+        src['egg']['ham'].create_file('ham')
+        assert make_wc().status() == 'dirty'
+        # the branch information is complete even if the status stopped
+        assert make_wc().git_probe()['ahead'] == 1
+        assert make_wc(untracked=False).status() == 'ahead'
+
+    def testProcessesEngine(self, mkgitrepo, src, caplog):
+        from mr.developer.common import ProcessWorkingCopies
+        import logging
+        caplog.set_level(logging.INFO)
+        repository = mkgitrepo('repository')
+        repository.add_file('foo')
+        sources = {}
+        for name in ('egg', 'ham'):
+            sources[name] = Source(
+                kind='git', name=name, url=repository.url, path=src[name])
+        workingcopies = ProcessWorkingCopies(sources, threads=2)
+        workingcopies.checkout(['egg', 'ham'])
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo'))
+        assert set(os.listdir(src['ham'])) == set(('.git', 'foo'))
+        assert "Cloned 'egg' with git from" in caplog.text
+        sources['egg']['branch'] = 'missing'
+        caplog.clear()
+        pytest.raises(SystemExit, workingcopies.update, ['egg'])
+        assert "No such branch" in caplog.text
+
+    def testProbe(self, mkgitrepo, src):
+        from mr.developer.common import WorkingCopies
+        repository = mkgitrepo('repository')
+        repository.add_file('foo')
+        sources = {}
+        for name in ('egg', 'ham'):
+            sources[name] = Source(
+                kind='git', name=name, url=repository.url, path=src[name])
+        WorkingCopies(sources).checkout(['egg', 'ham'])
+        src['ham']['bar'].create_file('bar')
+        results = WorkingCopies(sources).probe(['egg', 'ham'])
+        assert results == {
+            'egg': (True, 'clean', None),
+            'ham': (True, 'dirty', None)}
+        results = WorkingCopies(sources).probe(['ham'], verbose=True)
+        assert results['ham'][:2] == (True, 'dirty')
+        assert '?? bar' in results['ham'][2]
+
+    def testGitCacheDir(self, mkgitrepo, src, tempdir):
+        from mr.developer import git
+        repository = mkgitrepo('repository')
+        self.createDefaultContent(repository)
+        cache_dir = tempdir['cache']
+        mirror = git.mirror_path(cache_dir, repository.url)
+
+        def checkout(name):
+            wc = git.GitWorkingCopy(Source(
+                kind='git',
+                name=name,
+                url=repository.url,
+                path=src[name],
+                **{'git-cache-dir': cache_dir}))
+            wc.checkout(submodules='always')
+
+        def mirror_log():
+            return Process(cwd=mirror).check_call(
+                "git log --oneline master", echo=False)
+
+        with patch.dict('mr.developer.git._mirrors', clear=True):
+            checkout('egg')
+            assert len(mirror_log()) == 2
+            assert set(os.listdir(src['egg'])) == set(('.git', 'bar', 'foo'))
+            # the clone doesn't depend on the mirror
+            assert not os.path.exists(
+                os.path.join(src['egg'], '.git', 'objects', 'info', 'alternates'))
+            # the mirror is only updated once per run
+            repository.add_file('ham')
+            checkout('egg2')
+            assert set(os.listdir(src['egg2'])) == set(('.git', 'bar', 'foo', 'ham'))
+            assert len(mirror_log()) == 2
+            git._mirrors.clear()
+            checkout('egg3')
+            assert len(mirror_log()) == 3
+
+    def testPartialCloneOptions(self, mkgitrepo, src):
+        from mr.developer.git import GitWorkingCopy
+        repository = mkgitrepo('repository')
+        repository('git config uploadpack.allowFilter true')
+        self.createDefaultContent(repository)
+        for dirname in ('docs', 'src'):
+            os.mkdir(repository.base[dirname])
+            repository.base[dirname]['file'].create_file(dirname)
+            repository("git add %s" % dirname, echo=False)
+        repository("git commit -m dirs", echo=False)
+        wc = GitWorkingCopy(Source(
+            kind='git',
+            name='egg',
+            url=repository.url,
+            path=src['egg'],
+            filter='blob:none',
+            sparse='src',
+            **{'single-branch': True}))
+        if wc.git_version() < (2, 25):
+            pytest.skip("sparse-checkout requires git 2.25")
+        wc.checkout(submodules='always')
+        egg = Process(cwd=src['egg'])
+        # only the top level files and the sparse paths are checked out
+        assert set(os.listdir(src['egg'])) == set(('.git', 'bar', 'foo', 'src'))
+        lines = egg.check_call("git config remote.origin.partialclonefilter", echo=False)
+        assert lines == [b'blob:none']
+        lines = egg.check_call("git branch -r", echo=False)
+        assert b'origin/test' not in [x.strip() for x in lines]
+
+        # switching the branch of a single branch clone fetches it
+        wc = GitWorkingCopy(Source(wc.source, branch='test'))
+        wc.update(submodules='always')
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'foo2'))
+        lines = egg.check_call("git branch -r", echo=False)
+        assert b'origin/test' in [x.strip() for x in lines]
+
+    def testSparseNestedPath(self, mkgitrepo, src):
+        from mr.developer.git import GitWorkingCopy
+        repository = mkgitrepo('repository')
+        repository.add_file('foo')
+        for dirname in ('docs', 'src', 'src/nested', 'src/other'):
+            os.mkdir(repository.base[dirname])
+            repository.base[dirname]['file'].create_file(dirname)
+        repository("git add docs src", echo=False)
+        repository("git commit -m dirs", echo=False)
+        wc = GitWorkingCopy(Source(
+            kind='git',
+            name='egg',
+            url=repository.url,
+            path=src['egg'],
+            sparse='src/nested'))
+        if wc.git_version() < (2, 25):
+            pytest.skip("sparse-checkout requires git 2.25")
+        wc.checkout(submodules='never')
+        # the files of the parent directories are included in cone mode
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'src'))
+        assert set(os.listdir(src['egg']['src'])) == set(('file', 'nested'))
+        assert os.listdir(src['egg']['src']['nested']) == ['file']
+        egg = Process(cwd=src['egg'])
+        lines = egg.check_call("git config core.sparseCheckoutCone", echo=False)
+        assert lines == [b'true']
+
+    def testUpdateWithLocalRevision(self, mkgitrepo, src):
+        from mr.developer.git import GitWorkingCopy
+        repository = mkgitrepo('repository')
+        rev = self.createDefaultContent(repository)
+        repository("git tag 1.0 master", echo=False)
+
+        def update(rev):
+            wc = GitWorkingCopy(Source(
+                kind='git',
+                name='egg',
+                rev=rev,
+                url=repository.url,
+                path=src['egg']))
+            commands = record_git_commands(wc)
+            wc.checkout(submodules='never', update=True)
+            return commands
+
+        update(rev)
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'foo2'))
+        # the pinned revision is already checked out
+        assert update(rev) == ['status', 'rev-parse']
+        # the pinned tag is available locally
+        commands = update('1.0')
+        assert 'fetch' not in commands
+        assert 'checkout' in commands
+        assert set(os.listdir(src['egg'])) == set(('.git', 'bar', 'foo'))
+        # only the new pinned commit is fetched
+        repository.add_file('ham')
+        new_rev = s(repository("git rev-parse HEAD", echo=False)[0])
+        commands = update(new_rev)
+        assert commands.count('fetch') == 1
+        assert set(os.listdir(src['egg'])) == set(('.git', 'bar', 'foo', 'ham'))
+        # a branch isn't tried as a tag first
+        commands = update('test')
+        assert commands.count('fetch') == 1
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'foo2'))
+
+    def testUpdateBranchLookups(self, mkgitrepo, src):
+        from mr.developer.git import GitWorkingCopy
+        repository = mkgitrepo('repository')
+        self.createDefaultContent(repository)
+        source = Source(
+            kind='git',
+            name='egg',
+            url=repository.url,
+            path=src['egg'])
+        GitWorkingCopy(source).checkout(submodules='never')
+        wc = GitWorkingCopy(Source(source, branch='test'))
+        commands = record_git_commands(wc)
+        wc.checkout(submodules='never', update=True)
+        assert set(os.listdir(src['egg'])) == set(('.git', 'foo', 'foo2'))
+        # the refs of the branch are looked up once for switching and merging
+        assert commands == ['status', 'fetch', 'for-each-ref', 'checkout', 'merge']
+        assert wc._branch_refs('test') == set((
+            'refs/heads/test', 'refs/remotes/origin/test'))
+
+
+class TestGitRemoteUrls:
+    @pytest.fixture
+    def egg(self, develop, mkgitrepo, src):
+        from mr.developer.commands import CmdCheckout
+        repository = mkgitrepo('repository')
+        repository.add_file('foo')
+        develop.sources = {
+            'egg': Source(
+                kind='git',
+                name='egg',
+                url=repository.url,
+                path=src['egg'])}
+        CmdCheckout(develop)(develop.parser.parse_args(['co', 'egg']))
+        return develop.sources['egg']
+
+    def remote_urls(self, source):
+        from mr.developer.git import GitWorkingCopy
+        wc = GitWorkingCopy(Source(source))
+        commands = record_git_commands(wc)
+        return wc.git_remote_urls(), commands
+
+    def testReadFromConfig(self, egg):
+        urls, commands = self.remote_urls(egg)
+        assert urls == [egg['url']]
+        assert commands == []
+
+    def testIncludes(self, egg, tempdir):
+        tempdir['include.cfg'].create_file(
+            '[remote "origin"]',
+            '    pushurl = "git@example.com:egg.git"  # comment')
+        tempdir['other.cfg'].create_file(
+            '[remote "origin"]',
+            '    pushurl = git@example.com:other.git')
+        with open(egg['path'] + '/.git/config', 'a') as f:
+            f.write('[include]\n\tpath = %s\n' % tempdir['include.cfg'])
+            f.write('[includeIf "gitdir:%s/"]\n\tpath = %s\n' % (egg['path'], tempdir['include.cfg']))
+            f.write('[includeIf "gitdir:/nonexisting/"]\n\tpath = %s\n' % tempdir['other.cfg'])
+        urls, commands = self.remote_urls(egg)
+        assert urls == [egg['url'], 'git@example.com:egg.git', 'git@example.com:egg.git']
+        assert commands == []
+
+    def testWorktree(self, egg, src):
+        process = Process(cwd=egg['path'])
+        process.check_call("git worktree add %s" % src['worktree'], echo=False)
+        urls, commands = self.remote_urls(Source(egg, path=src['worktree']))
+        assert urls == [egg['url']]
+        assert commands == []
+
+    def testFallbackToGit(self, egg, tempdir):
+        tempdir['include.cfg'].create_file(
+            '[remote "origin"]',
+            '    pushurl = git@example.com:egg.git')
+        with open(egg['path'] + '/.git/config', 'a') as f:
+            f.write('[includeIf "onbranch:master"]\n\tpath = %s\n' % tempdir['include.cfg'])
+        urls, commands = self.remote_urls(egg)
+        assert urls == [egg['url'], 'git@example.com:egg.git']
+        assert commands == ['config']
+
+    def testInsteadOf(self, egg, monkeypatch, tempdir):
+        base = os.path.dirname(egg['url'])
+        with open(egg['path'] + '/.git/config', 'a') as f:
+            f.write('[url "%s/"]\n\tinsteadOf = local:\n' % base)
+        monkeypatch.setenv('HOME', tempdir)
+        tempdir['.gitconfig'].create_file(
+            '[url "git@example.com:"]',
+            '    pushInsteadOf = local:')
+        process = Process(cwd=egg['path'])
+        process.check_call("git remote set-url origin local:repository", echo=False)
+        urls, commands = self.remote_urls(egg)
+        assert urls == [
+            'local:repository', egg['url'], 'git@example.com:repository']
+        assert commands == []
+        # git itself applies the same rules
+        with open(egg['path'] + '/.git/config', 'a') as f:
+            f.write('[includeIf "onbranch:master"]\n\tpath = foo.cfg\n')
+        assert self.remote_urls(egg) == (urls, ['config'])
+
+    def testFallbackToGitForUnparsableConfig(self, egg):
+        with open(egg['path'] + '/.git/config', 'a') as f:
+            f.write('[remote "origin"]\n\tpushurl = "foo\\q"\n')
+        from mr.developer.git import GitWorkingCopy, GitError
+        wc = GitWorkingCopy(Source(egg))
+        pytest.raises(ValueError, wc._read_remote_urls)
+        # git itself can't read the config either
+        pytest.raises(GitError, self.remote_urls, egg)
@@ -1,7 +1,8 @@
 from mock import patch
 from mr.developer.extension import Source
-from mr.developer.tests.utils import GitRepo
+from mr.developer.tests.utils import GitRepo, record_git_commands
 import os
+import pytest
 
 
 class TestGitSubmodules:
@@ -342,3 +343,33 @@ class TestGitSubmodules:
                 ('info', ("Switching to branch 'master'.",), {})]
         finally:
             _log.__exit__(None, None, None)
+
+    def testCheckoutUpdatesNewSubmodulesInOneCommand(self, mkgitrepo, src):
+        """
+            Tests that the new submodules 'submodule_a' and 'submodule_b' of
+            'egg' are updated by a single parallel 'git submodule update'.
+        """
+        from mr.developer.git import GitWorkingCopy
+        submodule_a = mkgitrepo('submodule_a')
+        submodule_a.add_file('foo')
+        submodule_b = mkgitrepo('submodule_b')
+        submodule_b.add_file('foo_b')
+        egg = mkgitrepo('egg')
+        egg.add_file('bar')
+        egg.add_submodule(submodule_a, 'submodule_a')
+        egg.add_submodule(submodule_b, 'submodule_b')
+
+        wc = GitWorkingCopy(Source(
+            kind='git',
+            name='egg',
+            url=egg.url,
+            path=src['egg']))
+        if wc.git_version() < (2, 9):
+            pytest.skip("git submodule update --jobs requires git 2.9")
+        commands = record_git_commands(wc, arguments=True)
+        wc.checkout(submodules='always', jobs=4)
+        assert set(os.listdir(src['egg/submodule_a'])) == set(('.git', 'foo'))
+        assert set(os.listdir(src['egg/submodule_b'])) == set(('.git', 'foo_b'))
+        updates = [x for x in commands if 'update' in x]
+        assert len(updates) == 1
+        assert updates[0][-4:] == ['--jobs', '4', 'submodule_a', 'submodule_b']
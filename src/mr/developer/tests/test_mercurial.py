@@ -115,3 +115,73 @@ class TestMercurial:
                     url='%s' % repository,
                     path=os.path.join(src, 'egg-failed'))}
             CmdCheckout(develop)(develop.parser.parse_args(['co', 'egg']))
+
+    def testStatusAheadWithNonPublishingRemote(self, develop, src, tempdir):
+        from mr.developer.commands import CmdCheckout
+        from mr.developer.commands import CmdUpdate
+        from mr.developer.mercurial import MercurialWorkingCopy
+        repository = tempdir['repository']
+        os.mkdir(repository)
+        process = Process(cwd=repository)
+        process.check_call("hg init %s" % repository)
+        repository['.hg']['hgrc'].create_file(
+            "[phases]",
+            "publish = False")
+        foo = repository['foo']
+        foo.create_file('foo')
+        process.check_call("hg add %s" % foo, echo=False)
+        process.check_call("hg commit %s -m foo -u test" % foo, echo=False)
+        source = Source(
+            kind='hg',
+            name='egg',
+            url='%s' % repository,
+            path=os.path.join(src, 'egg'))
+        develop.sources = {'egg': source}
+        with patch('mr.developer.mercurial.logger'):
+            CmdCheckout(develop)(develop.parser.parse_args(['co', 'egg']))
+            CmdUpdate(develop)(develop.parser.parse_args(['up', 'egg']))
+        # the pulled changesets are still drafts, but known remotely
+        assert MercurialWorkingCopy(source).status() == 'clean'
+        process = Process(cwd=src['egg'])
+        bar = src['egg']['bar']
+        bar.create_file('bar')
+        process.check_call("hg add %s" % bar, echo=False)
+        process.check_call("hg commit %s -m bar -u test" % bar, echo=False)
+        assert MercurialWorkingCopy(source).status() == 'ahead'
+
+    def testWithoutRemotenames(self, develop, src, tempdir):
+        from mr.developer import common
+        from mr.developer.commands import CmdCheckout
+        from mr.developer.mercurial import MercurialWorkingCopy
+        repository = tempdir['repository']
+        os.mkdir(repository)
+        process = Process(cwd=repository)
+        process.check_call("hg init %s" % repository)
+        foo = repository['foo']
+        foo.create_file('foo')
+        process.check_call("hg add %s" % foo, echo=False)
+        process.check_call("hg commit %s -m foo -u test" % foo, echo=False)
+        source = Source(
+            kind='hg',
+            name='egg',
+            url='%s' % repository,
+            path=os.path.join(src, 'egg'))
+        develop.sources = {'egg': source}
+        commands = []
+        run = common.runner.run
+
+        def _run(args, **kwargs):
+            commands.append(args)
+            return run(args, **kwargs)
+
+        # mercurial before 4.5 has no remotenames extension
+        with patch.object(MercurialWorkingCopy, 'hg_version', return_value=(4, 4)):
+            with patch('mr.developer.common.runner.run', side_effect=_run):
+                with patch('mr.developer.mercurial.logger'):
+                    CmdCheckout(develop)(develop.parser.parse_args(['co', 'egg']))
+                assert MercurialWorkingCopy(source).status() == 'clean'
+        args = [x for command in commands for x in command]
+        assert 'clone' in args
+        assert 'draft()' in args
+        assert '--pull' not in args
+        assert 'extensions.remotenames=' not in args
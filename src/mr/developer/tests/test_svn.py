@@ -3,6 +3,7 @@ from mr.developer.extension import Source
 from mr.developer.tests.utils import Process
 import os
 import pytest
+import sys
 
 
 class TestSVN:
@@ -76,3 +77,137 @@ class TestSVN:
         assert set(os.listdir(src['egg'])) == set(('.svn', 'foo'))
         CmdUpdate(develop)(develop.parser.parse_args(['up', 'egg']))
         assert set(os.listdir(src['egg'])) == set(('.svn', 'foo'))
+
+    def _working_copies(self, tempdir, names):
+        from mr.developer.svn import SVNWorkingCopy
+        wcs = []
+        for name in names:
+            path = tempdir[name]
+            os.makedirs(os.path.join(path, '.svn'))
+            with patch('mr.developer.common.which', return_value='svn'):
+                with patch.object(SVNWorkingCopy, '_svn_check_version'):
+                    wcs.append(SVNWorkingCopy(Source(
+                        kind='svn', name=name, path=path,
+                        url='file:///repo/%s' % name)))
+        return wcs
+
+    def _popen(self, script):
+        """ Returns a replacement for ``runner.popen`` which runs the python
+            ``script`` instead of the svn command.
+        """
+        from mr.developer import common
+
+        def popen(args, **kwargs):
+            return common.Popen([sys.executable, '-c', script], **kwargs)
+        return popen
+
+    def testPrefetch(self, tempdir):
+        from mr.developer.svn import SVNWorkingCopy
+        wcs = self._working_copies(tempdir, ('foo', 'bar'))
+        paths = [wc.source['path'] for wc in wcs]
+        foo, bar = paths
+        info = (
+            '<info>'
+            '<entry path="%s" revision="3"><url>file:///repo/foo</url>'
+            '<repository><root>file:///repo</root></repository></entry>'
+            '<entry path="%s" revision="5"><url>file:///repo/bar</url></entry>'
+            '</info>') % (foo, bar)
+        status = (
+            '<status>'
+            '<target path="%s"><entry path="%s/x">'
+            '<wc-status item="external"/></entry></target>'
+            '<target path="%s"/>'
+            '<target path="%s/x"><entry path="%s/x/y">'
+            '<wc-status item="modified"/></entry></target>'
+            '</status>') % (foo, foo, bar, bar, bar)
+        popen = self._popen('import sys; sys.stdout.write(%r)' % status)
+        with patch('mr.developer.common.runner.popen', side_effect=popen) as status_popen:
+            with patch('mr.developer.common.runner.run', return_value=(0, info.encode('ascii'), b'')) as run:
+                SVNWorkingCopy.prefetch(wcs)
+        assert run.call_count == 1
+        assert run.call_args[0][0][-2:] == sorted(paths)
+        assert status_popen.call_args[0][0][-2:] == sorted(paths)
+        assert SVNWorkingCopy._svn_info_cache.get(foo) == {
+            'revision': '3', 'url': 'file:///repo/foo'}
+        assert SVNWorkingCopy._svn_info_cache.get(bar) == {
+            'revision': '5', 'url': 'file:///repo/bar'}
+        assert SVNWorkingCopy._svn_status_cache.get(foo) is True
+        assert SVNWorkingCopy._svn_status_cache.get(bar) is False
+        # the prefetched status is used once
+        assert wcs[0].status() == 'clean'
+        assert SVNWorkingCopy._svn_status_cache.get(foo) is None
+        # the cached info isn't fetched again, mutating commands drop it
+        with patch('mr.developer.common.runner.popen', side_effect=popen):
+            with patch('mr.developer.common.runner.run') as run:
+                SVNWorkingCopy.prefetch(wcs)
+        assert run.call_count == 0
+        with patch('mr.developer.common.runner.run', return_value=(0, b'', b'')):
+            wcs[1]._svn_update()
+        assert SVNWorkingCopy._svn_info_cache.get(bar) is None
+        assert SVNWorkingCopy._svn_status_cache.get(bar) is None
+        assert SVNWorkingCopy._svn_info_cache.get(foo) is not None
+
+    def testStatusStopsAtFirstChange(self, tempdir):
+        from mr.developer.svn import SVNError
+        wc, = self._working_copies(tempdir, ('foo',))
+        # writes unversioned entries until it's killed
+        script = '\n'.join([
+            'import sys',
+            'sys.stdout.write("<status><target path=\\"foo\\">")',
+            'while True:',
+            '    sys.stdout.write("<entry path=\\"foo/x\\"><wc-status item=\\"unversioned\\"/></entry>")',
+            '    sys.stdout.flush()'])
+        with patch('mr.developer.common.runner.popen', side_effect=self._popen(script)):
+            assert wc.status() == 'dirty'
+        script = 'import sys; sys.stdout.write(%r)' % (
+            '<status><target path="foo"><entry path="foo/x">'
+            '<wc-status item="external"/></entry></target></status>')
+        with patch('mr.developer.common.runner.popen', side_effect=self._popen(script)):
+            assert wc.status() == 'clean'
+        script = 'import sys; sys.stderr.write("E155007: not a working copy"); sys.exit(1)'
+        with patch('mr.developer.common.runner.popen', side_effect=self._popen(script)):
+            with pytest.raises(SVNError) as e:
+                wc.status()
+        assert 'E155007' in e.value.args[0]
+
+    def testStatusOutputIsProfiled(self, tempdir):
+        from mr.developer.common import profiler
+        wc, = self._working_copies(tempdir, ('foo',))
+        output = (
+            '<status><target path="foo"><entry path="foo/x">'
+            '<wc-status item="external"/></entry></target></status>')
+        script = 'import sys; sys.stdout.write(%r)' % output
+        profiler.enable(tempdir['profile.jsonl'])
+        try:
+            with patch('mr.developer.common.runner.popen', side_effect=self._popen(script)):
+                assert wc.status() == 'clean'
+            spans = profiler.take()
+        finally:
+            profiler.enable(None)
+        assert [x['args']['output'] for x in spans] == [len(output)]
+
+
+class TestPathCache:
+    def testExpiry(self, tempdir):
+        from mr.developer.svn import PathCache
+        cache = PathCache(ttl=60)
+        cache.set(tempdir['foo'], 1)
+        assert cache.get(os.path.join(tempdir['foo'], '.')) == 1
+        cache.ttl = -1
+        cache.set(tempdir['bar'], 2)
+        assert cache.get(tempdir['bar']) is None
+        assert cache.pop(tempdir['foo']) == 1
+        assert cache.get(tempdir['foo']) is None
+
+    def testSize(self, tempdir):
+        from mr.developer.svn import PathCache
+        cache = PathCache(size=2)
+        cache.set(tempdir['foo'], 1)
+        cache.set(tempdir['bar'], 2)
+        cache.set(tempdir['foo'], 3)
+        cache.set(tempdir['ham'], 4)
+        assert cache.get(tempdir['bar']) is None
+        assert cache.get(tempdir['foo']) == 3
+        cache.invalidate(tempdir['foo'])
+        assert cache.get(tempdir['foo']) is None
+        assert cache.get(tempdir['ham']) == 4
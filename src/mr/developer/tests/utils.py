@@ -139,6 +139,21 @@ class Process(object):
         return lines
 
 
+def record_git_commands(wc, arguments=False):
+    """ Returns a list to which the git commands run by ``wc`` are added,
+        or their whole argument lists with ``arguments`` set.
+    """
+    commands = []
+    run_git = wc.run_git
+
+    def _run_git(args, **kwargs):
+        commands.append(list(args) if arguments else args[0])
+        return run_git(args, **kwargs)
+
+    wc.run_git = _run_git
+    return commands
+
+
 class MockConfig(object):
     def __init__(self):
         self.buildout_args = []
@@ -161,6 +176,8 @@ class MockDevelop(object):
         self.parser = ArgumentParser()
         self.parsers = self.parser.add_subparsers(title="commands", metavar="")
         self.threads = 1
+        self.host_threads = {}
+        self.engine = 'threads'
 
 
 class GitRepo(object):